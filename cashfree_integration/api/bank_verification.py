@@ -1,8 +1,35 @@
+import logging
+
 import frappe
-from cashfree_integration.api.payouts import (
-    get_cashfree_settings,
-    check_beneficiary_exists,
-    create_beneficiary_v2
+from cashfree_integration.api_manager import CashfreeAPIManager
+from cashfree_integration.api.payouts import beneficiary_exists, create_or_get_beneficiary
+from cashfree_integration.api.payment_validation import BANK_VERIFY_STATUS_KEY
+from cashfree_integration.api.bav import (
+    apply_bav_response,
+    get_bav_request_config,
+    get_contact_details_from_bank,
+    get_party_name_from_bank,
+    post_bav_sync_many,
+    prefetch_party_names,
+    validate_bank_details
+)
+
+
+# Bank Account columns read by the verification paths
+BANK_ACCOUNT_FIELDS = [
+    "name", "bank", "bank_account_no", "branch_code", "custom_ifsc_code", "account_name",
+    "party", "party_type", "custom_cashfree_beneficiary_id", "custom_bank_account_approval_status",
+    "custom_verified_date", "custom_verified_by", "custom_bank_account_verified"
+]
+
+# Accounts verified per background batch (bounds memory for large runs)
+BULK_BATCH_SIZE = 50
+
+# Bank Account columns written back after a BAV response
+VERIFICATION_RESULT_FIELDS = (
+    "account_name", "bank", "branch_code", "custom_ifsc_code",
+    "custom_bank_account_approval_status", "custom_bank_account_verified",
+    "custom_verified_by", "custom_verification_notesreason"
 )
 
 
@@ -21,109 +48,139 @@ def verify_bank_account_standalone(bank_account_name):
     try:
         frappe.logger().info(f"🔍 Starting verification for bank account: {bank_account_name}")
         
-        # Get Bank Account
-        bank = frappe.get_doc("Bank Account", bank_account_name)
-        
-        # Validate required fields
-        if not bank.bank_account_no:
+        # Get Bank Account (only the fields verification reads)
+        bank = frappe.db.get_value("Bank Account", bank_account_name, BANK_ACCOUNT_FIELDS, as_dict=True)
+        if not bank:
             return {
                 "success": False,
-                "message": "Bank Account Number is required",
-                "error_type": "MISSING_FIELD"
+                "message": f"Verification failed: Bank Account {bank_account_name} not found",
+                "error_type": "GENERAL_ERROR"
             }
         
-        if not bank.branch_code:
-            return {
-                "success": False,
-                "message": "IFSC Code (Branch Code) is required",
-                "error_type": "MISSING_FIELD"
-            }
+        return _verify_from_row(bank)
+    
+    except Exception as e:
+        # General error (traceback only formatted when debug logging is on)
+        logger = frappe.logger()
+        logger.error("❌ Verification error: %s", e)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Traceback:\n%s", frappe.get_traceback())
         
-        # Get Cashfree settings
+        return {
+            "success": False,
+            "message": f"Verification failed: {str(e)}",
+            "error_type": "GENERAL_ERROR"
+        }
+
+
+def _verify_from_row(bank, cf_manager=None):
+    """
+    Verify a prefetched Bank Account row (see BANK_ACCOUNT_FIELDS)
+    Pass cf_manager to share one CashfreeAPIManager across several accounts
+    """
+    # Validate required fields
+    if not bank.bank_account_no:
+        return {
+            "success": False,
+            "message": "Bank Account Number is required",
+            "error_type": "MISSING_FIELD"
+        }
+    
+    if not bank.branch_code:
+        return {
+            "success": False,
+            "message": "IFSC Code (Branch Code) is required",
+            "error_type": "MISSING_FIELD"
+        }
+    
+    format_error, account_no, ifsc = validate_bank_details(bank.bank_account_no, bank.branch_code)
+    if format_error:
+        return {
+            "success": False,
+            "message": format_error,
+            "error_type": "INVALID_FORMAT"
+        }
+    
+    # Beneficiary creation reads these off the doc, so hand it the normalized values
+    bank.bank_account_no = account_no
+    bank.branch_code = ifsc
+    
+    # Get Cashfree settings
+    if cf_manager is None:
         try:
-            settings, base_url, client_id, client_secret = get_cashfree_settings()
+            cf_manager = CashfreeAPIManager()
         except Exception as e:
             return {
                 "success": False,
                 "message": f"Cashfree settings not configured: {str(e)}",
                 "error_type": "SETTINGS_ERROR"
             }
+    
+    # Check if beneficiary already exists
+    existing_bene_id = bank.get("custom_cashfree_beneficiary_id")
+    verification_status = bank.get("custom_bank_account_approval_status")
+    
+    if existing_bene_id and verification_status == "Approved":
+        # Beneficiary exists - verify it's still active in Cashfree
+        frappe.logger().info(f"✅ Found existing beneficiary: {existing_bene_id}")
         
-        # Check if beneficiary already exists
-        existing_bene_id = bank.get("custom_cashfree_beneficiary_id")
-        verification_status = bank.get("custom_bank_account_approval_status")
-        
-        if existing_bene_id and verification_status == "Approved":
-            # Beneficiary exists - verify it's still active in Cashfree
-            frappe.logger().info(f"✅ Found existing beneficiary: {existing_bene_id}")
-            
-            if check_beneficiary_exists(existing_bene_id, client_id, client_secret, base_url):
-                # Beneficiary still exists in Cashfree
-                return {
-                    "success": True,
-                    "message": "Bank account already verified",
-                    "beneficiary_id": existing_bene_id,
-                    "already_verified": True,
-                    "verification_details": {
-                        "status": "Approved",
-                        "beneficiary_id": existing_bene_id,
-                        "verified_date": bank.get("custom_verified_date"),
-                        "verified_by": bank.get("custom_verified_by")
-                    }
-                }
-            else:
-                # Beneficiary was deleted from Cashfree - need to recreate
-                frappe.logger().info(f"⚠️ Beneficiary {existing_bene_id} not found in Cashfree - recreating")
-        
-        # Create/verify beneficiary in Cashfree
-        frappe.logger().info(f"🔄 Creating beneficiary for {bank_account_name}")
-        
-        try:
-            bene_id = create_beneficiary_v2(bank, client_id, client_secret, base_url)
-            
-            # Success - beneficiary created and bank account updated
+        if beneficiary_exists(cf_manager, existing_bene_id):
+            # Beneficiary still exists in Cashfree
             return {
                 "success": True,
-                "message": "Bank account verified successfully",
-                "beneficiary_id": bene_id,
-                "already_verified": False,
+                "message": "Bank account already verified",
+                "beneficiary_id": existing_bene_id,
+                "already_verified": True,
                 "verification_details": {
                     "status": "Approved",
-                    "beneficiary_id": bene_id,
-                    "account_number": bank.bank_account_no[-4:],
-                    "ifsc": bank.branch_code,
-                    "account_name": bank.account_name,
-                    "verified_date": frappe.utils.now(),
-                    "verified_by": frappe.session.user
-                }
-            }
-            
-        except Exception as beneficiary_error:
-            # Beneficiary creation failed
-            error_message = str(beneficiary_error)
-            frappe.logger().error(f"❌ Beneficiary creation failed: {error_message}")
-            
-            return {
-                "success": False,
-                "message": error_message,
-                "error_type": "BENEFICIARY_ERROR",
-                "verification_details": {
-                    "status": "Failed",
-                    "error": error_message,
-                    "bank_account": bank_account_name,
-                    "account_number": bank.bank_account_no[-4:] if bank.bank_account_no else None,
-                    "ifsc": bank.branch_code
+                    "beneficiary_id": existing_bene_id,
+                    "verified_date": bank.get("custom_verified_date"),
+                    "verified_by": bank.get("custom_verified_by")
                 }
             }
+        else:
+            # Beneficiary was deleted from Cashfree - need to recreate
+            frappe.logger().info(f"⚠️ Beneficiary {existing_bene_id} not found in Cashfree - recreating")
     
-    except Exception as e:
-        # General error
-        frappe.logger().error(f"❌ Verification error: {str(e)}\n{frappe.get_traceback()}")
+    # Create/verify beneficiary in Cashfree
+    frappe.logger().info(f"🔄 Creating beneficiary for {bank.name}")
+    
+    try:
+        bene_id, _ = create_or_get_beneficiary(bank, cf_manager)
+        
+        # Success - beneficiary created and bank account updated
+        return {
+            "success": True,
+            "message": "Bank account verified successfully",
+            "beneficiary_id": bene_id,
+            "already_verified": False,
+            "verification_details": {
+                "status": "Approved",
+                "beneficiary_id": bene_id,
+                "account_number": bank.bank_account_no[-4:],
+                "ifsc": bank.branch_code,
+                "account_name": bank.account_name,
+                "verified_date": frappe.utils.now(),
+                "verified_by": frappe.session.user
+            }
+        }
+        
+    except Exception as beneficiary_error:
+        # Beneficiary creation failed
+        error_message = str(beneficiary_error)
+        frappe.logger().error(f"❌ Beneficiary creation failed: {error_message}")
         
         return {
             "success": False,
-            "message": f"Verification failed: {str(e)}",
-            "error_type": "GENERAL_ERROR"
+            "message": error_message,
+            "error_type": "BENEFICIARY_ERROR",
+            "verification_details": {
+                "status": "Failed",
+                "error": error_message,
+                "bank_account": bank.name,
+                "account_number": bank.bank_account_no[-4:] if bank.bank_account_no else None,
+                "ifsc": bank.branch_code
+            }
         }
 
 
@@ -136,52 +193,248 @@ def bulk_verify_bank_accounts(bank_account_names):
         bank_account_names: JSON string or list of bank account names
     
     Returns:
-        dict: {total, success_count, failed_count, results[]}
+        dict: {total, success_count, failed_count, results[{bank_account, success, message}]}
     """
+    frappe.has_permission("Bank Account", "write", throw=True)
+    
+    bank_account_names = _parse_bank_account_names(bank_account_names)
+    if bank_account_names is None:
+        return {
+            "success": False,
+            "message": "Invalid input format. Expected JSON array of bank account names."
+        }
+    
+    results = []
+    success_count = 0
+    failed_count = 0
+    
+    for bank_name, result in _verify_batch(bank_account_names):
+        if result.get("success"):
+            success_count += 1
+        else:
+            failed_count += 1
+        
+        results.append({
+            "bank_account": bank_name,
+            "success": bool(result.get("success")),
+            "message": result.get("message")
+        })
+    
+    return {
+        "total": len(bank_account_names),
+        "success_count": success_count,
+        "failed_count": failed_count,
+        "results": results
+    }
+
+
+@frappe.whitelist()
+def bulk_verify_bank_accounts_streaming(bank_account_names):
+    """
+    Verify multiple bank accounts in a background job
+    Progress is pushed to the caller as "bav_progress" realtime events.
+    
+    Args:
+        bank_account_names: JSON string or list of bank account names
+    
+    Returns:
+        dict: {success, job_name, total}
+    """
+    frappe.has_permission("Bank Account", "write", throw=True)
+    
+    bank_account_names = _parse_bank_account_names(bank_account_names)
+    if bank_account_names is None:
+        return {
+            "success": False,
+            "message": "Invalid input format. Expected JSON array of bank account names."
+        }
+    
+    job_name = f"bulk_bav_{frappe.generate_hash(length=10)}"
+    
+    frappe.enqueue(
+        "cashfree_integration.api.bank_verification.bulk_verify_worker",
+        queue="long",
+        job_name=job_name,
+        bank_account_names=bank_account_names,
+        user=frappe.session.user
+    )
+    
+    return {"success": True, "job_name": job_name, "total": len(bank_account_names)}
+
+
+def bulk_verify_worker(bank_account_names, user):
+    """Background job: verify accounts in batches and publish each result"""
+    total = len(bank_account_names)
+    done = 0
+    
+    for start in range(0, total, BULK_BATCH_SIZE):
+        batch = bank_account_names[start:start + BULK_BATCH_SIZE]
+        
+        for bank_name, result in _verify_batch(batch):
+            done += 1
+            frappe.publish_realtime(
+                "bav_progress",
+                {
+                    "name": bank_name,
+                    "result": {"success": bool(result.get("success")), "message": result.get("message")},
+                    "done": done,
+                    "total": total
+                },
+                user=user
+            )
+
+
+def _parse_bank_account_names(bank_account_names):
+    """Accept a list or JSON array string; None if it can't be parsed"""
     import json
     
-    # Parse input
     if isinstance(bank_account_names, str):
         try:
             bank_account_names = json.loads(bank_account_names)
         except:
-            return {
-                "success": False,
-                "message": "Invalid input format. Expected JSON array of bank account names."
-            }
+            return None
     
+    return bank_account_names
+
+
+def _verify_batch(bank_account_names):
+    """
+    Verify a batch of Bank Accounts through BAV and persist the outcomes
+    
+    Returns:
+        list of (bank_account_name, result dict)
+    """
     results = []
-    success_count = 0
-    failed_count = 0
+    
+    # Prefetch every Bank Account in one query
+    banks = {
+        b.name: b for b in frappe.get_all(
+            "Bank Account",
+            filters={"name": ["in", bank_account_names]},
+            fields=BANK_ACCOUNT_FIELDS
+        )
+    }
+    
+    # Party display names for every account, one query per party type
+    prefetched_party_names = prefetch_party_names(banks.values())
+    
+    # Build payloads up front (DB lookups stay on this thread)
+    payloads = {}
+    party_names = {}
+    errors = {}
+    already_verified = set()
     
     for bank_name in bank_account_names:
+        bank = banks.get(bank_name)
+        if not bank:
+            errors[bank_name] = ("Bank Account not found", "MISSING_FIELD")
+            continue
+        
+        # Already verified - no Cashfree call needed
+        if bank.custom_bank_account_verified:
+            already_verified.add(bank_name)
+            continue
+        
+        ifsc = bank.branch_code or bank.custom_ifsc_code
+        if not bank.bank_account_no or not ifsc:
+            errors[bank_name] = ("Bank Account Number and IFSC Code are required", "MISSING_FIELD")
+            continue
+        
+        format_error, account_no, ifsc = validate_bank_details(bank.bank_account_no, ifsc)
+        if format_error:
+            errors[bank_name] = (format_error, "INVALID_FORMAT")
+            continue
+        
+        party_names[bank_name] = get_party_name_from_bank(bank, prefetched_party_names)
+        email, phone = get_contact_details_from_bank(bank)
+        
+        payloads[bank_name] = {
+            "bank_account": account_no,
+            "ifsc": ifsc,
+            "name": party_names[bank_name],
+            "phone": phone or "9999999999"
+        }
+    
+    # Fan out the Cashfree calls concurrently
+    responses = {}
+    if payloads:
         try:
-            result = verify_bank_account_standalone(bank_name)
+            url, headers = get_bav_request_config()
+            responses = post_bav_sync_many(payloads, url, headers)
+        except Exception as e:
+            for bank_name in payloads:
+                errors[bank_name] = (f"Cashfree settings not configured: {str(e)}", "SETTINGS_ERROR")
+    
+    # Apply responses to the prefetched rows, then persist them in bulk
+    updates = {}
+    
+    for bank_name in bank_account_names:
+        try:
+            if bank_name in errors:
+                message, error_type = errors[bank_name]
+                result = {"success": False, "message": message, "error_type": error_type}
+            
+            elif bank_name in already_verified:
+                result = {"success": True, "message": "Already Verified", "skip": True}
+            
+            elif isinstance(responses.get(bank_name), Exception):
+                result = {
+                    "success": False,
+                    "message": f"Network error: {str(responses[bank_name])}",
+                    "error_type": "NETWORK_ERROR"
+                }
             
-            if result.get("success"):
-                success_count += 1
             else:
-                failed_count += 1
+                status_code, data, resp_text = responses[bank_name]
+                if data is None:
+                    result = {
+                        "success": False,
+                        "message": f"Invalid JSON response from Cashfree: {resp_text[:200]}",
+                        "error_type": "API_ERROR"
+                    }
+                else:
+                    bank = banks[bank_name]
+                    outcome = apply_bav_response(
+                        bank, payloads[bank_name]["ifsc"], party_names[bank_name], status_code, data
+                    )
+                    updates[bank_name] = {field: bank.get(field) for field in VERIFICATION_RESULT_FIELDS}
+                    
+                    result = {
+                        "success": outcome["success"],
+                        "message": outcome.get("failure_reason") or outcome["message"]
+                    }
+                    if outcome.get("api_error"):
+                        result["error_type"] = "API_ERROR"
             
-            results.append({
-                "bank_account": bank_name,
-                "result": result
-            })
+            results.append((bank_name, result))
             
         except Exception as e:
-            failed_count += 1
-            results.append({
-                "bank_account": bank_name,
-                "result": {
+            results.append((bank_name, {
+                "success": False,
+                "message": str(e),
+                "error_type": "EXCEPTION"
+            }))
+    
+    # One CASE-WHEN UPDATE per chunk instead of a full save() per account
+    if updates:
+        try:
+            frappe.db.bulk_update("Bank Account", updates, chunk_size=100)
+            frappe.db.commit()
+            
+            # bulk_update skips on_update, so drop cached verification status here
+            for bank_name in updates:
+                frappe.cache().hdel(BANK_VERIFY_STATUS_KEY, bank_name)
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), "Bulk Bank Verification Update Failed")
+            
+            results = [
+                (bank_name, {
                     "success": False,
-                    "message": str(e),
+                    "message": f"Failed to save verification result: {str(e)}",
                     "error_type": "EXCEPTION"
-                }
-            })
+                }) if bank_name in updates else (bank_name, result)
+                for bank_name, result in results
+            ]
     
-    return {
-        "total": len(bank_account_names),
-        "success_count": success_count,
-        "failed_count": failed_count,
-        "results": results
-    }
+    return results
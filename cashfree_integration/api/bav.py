@@ -1,9 +1,137 @@
 # File: bav.py
 # Bank Account Verification using Cashfree BAV V2 API
 
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
 import frappe
 import requests
 from frappe.utils import now
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+    
+    _json_loads = orjson.loads
+    
+    def _json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    import json
+    
+    _json_loads = json.loads
+    
+    def _json_dumps(obj):
+        return json.dumps(obj, indent=2)
+
+
+# Max concurrent BAV calls in a bulk run (keeps us inside Cashfree rate limits)
+BULK_MAX_WORKERS = 10
+
+# (connect, read) timeout for BAV calls. Sync responses normally arrive in well under
+# a second, so a hung socket is cut loose after 10s instead of holding a worker for 30s.
+BAV_TIMEOUT = (3.05, 10)
+
+# Decrypted Cashfree credentials, per site: {site: {"value": (...), "version", "expires": monotonic}}
+_settings_cache = {}
+
+# Redis key bumped when Cashfree Settings change; per-process copies of the settings
+# (and the payout CashfreeAPIManager) built under an older version are rebuilt
+SETTINGS_VERSION_KEY = "cashfree:settings_version"
+
+# Uppercased bank_name -> Bank name, per site: {site: {"map": {...}, "expires": monotonic}}
+_BANK_INDEX = {}
+
+# BAV (url, headers) built from the cached credentials, per site: {site: (settings_value, config)}
+_request_config_cache = {}
+
+# Shared keep-alive session so the TLS handshake to Cashfree is paid once per worker.
+# Retry only covers connection failures for POST (urllib3 won't replay a sent POST),
+# so a billable verification is never submitted twice.
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504))
+)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+# In-flight BAV calls keyed by site+client+account+IFSC+name+phone, so a double-click or overlapping
+# bulk run waits on the running call instead of paying for a second one
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Display-name column read for each party type (anything else falls back to name)
+_PARTY_NAME_FIELDS = {"Supplier": "supplier_name", "Customer": "customer_name"}
+
+# Formats Cashfree accepts - checked locally so malformed input never costs a BAV call
+_IFSC_RE = re.compile(r"^[A-Z]{4}0[A-Z0-9]{6}$")
+_ACCT_RE = re.compile(r"^\d{9,18}$")
+
+# Text fields read from a BAV V2 response, in apply_bav_response unpack order
+_BAV_TEXT_FIELDS = (
+    "reference_id", "name_at_bank", "bank_name", "branch", "city", "micr",
+    "account_status", "account_status_code", "name_match_result", "utr"
+)
+
+# Success notes / msgprint built once at import and filled with str.format_map
+_NOTES_TEMPLATE = (
+    "✅ Bank Account Verified Successfully (BAV V2 - Cashfree API)\n\n"
+    "═══════════════════════════════════\n"
+    "VERIFICATION DETAILS\n"
+    "═══════════════════════════════════\n"
+    "Verification Method: Cashfree BAV V2 Sync API\n"
+    "Reference ID: {reference_id}\n"
+    "Verified Via: Cashfree Bank Account Verification\n"
+    "Initiated By: {user}\n"
+    "Timestamp: {timestamp}\n"
+    "UTR: {utr}\n\n"
+    "═══════════════════════════════════\n"
+    "BANK DETAILS (FROM BANK)\n"
+    "═══════════════════════════════════\n"
+    "Bank Name: {bank_name}\n"
+    "Branch: {branch}\n"
+    "City: {city}\n"
+    "MICR: {micr}\n"
+    "Name at Bank: {name_at_bank}\n"
+    "Account Status: {account_status}\n"
+    "Status Code: {account_status_code}\n\n"
+    "═══════════════════════════════════\n"
+    "NAME VERIFICATION\n"
+    "═══════════════════════════════════\n"
+    "Submitted Name: {party_name}\n"
+    "Bank Records Show: {name_at_bank}\n"
+    "Match Score: {name_match_display}\n"
+    "Match Result: {name_match_result}"
+    "{name_match_warning}\n\n"
+    "═══════════════════════════════════\n"
+    "ACTIONS TAKEN\n"
+    "═══════════════════════════════════\n"
+    "✓ Account Name updated to: {name_at_bank}\n"
+    "✓ Bank Name: {bank}\n"
+    "✓ IFSC Code confirmed: {ifsc}\n"
+    "✓ Verification Status: Approved\n"
+    "✓ Account marked as verified by Cashfree API"
+)
+
+_MSGPRINT_TEMPLATE = (
+    "✅ <b>Bank Account Verified & Updated</b><br><br>"
+    "<div style='background: #d4edda; padding: 15px; border-left: 4px solid #28a745; margin: 10px 0;'>"
+    "<b>Account Number:</b> {account_number}<br>"
+    "<b>Bank Name:</b> {bank_name}<br>"
+    "<b>Branch:</b> {branch}<br>"
+    "<b>Name at Bank:</b> {name_at_bank}<br>"
+    "<b>Match Score:</b> {name_match_display}<br>"
+    "<b>Status:</b> {account_status}"
+    "</div><br>"
+    "<b>Reference ID:</b> {reference_id}"
+    "{name_warning_html}"
+)
 
 
 @frappe.whitelist()
@@ -44,27 +172,11 @@ def verify_bank_account_button(bank_account_name):
     if not ifsc:
         frappe.throw("IFSC Code is missing")
     
-    # Get Cashfree settings
-    settings = frappe.get_single("Cashfree Settings")
+    format_error, account_no, ifsc = validate_bank_details(bank.bank_account_no, ifsc)
+    if format_error:
+        frappe.throw(format_error)
     
-    # ✅ BAV V2 API uses different base URL than Payouts
-    # Sandbox: https://sandbox.cashfree.com/verification
-    # Production: https://api.cashfree.com/verification
-    
-    # Determine environment from settings
-    if settings.environment == "Sandbox":
-        verification_base = "https://sandbox.cashfree.com/verification"
-    else:
-        verification_base = "https://api.cashfree.com/verification"
-    
-    # Use Sync API for instant results
-    url = f"{verification_base}/bank-account/sync"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "x-client-id": settings.client_id,
-        "x-client-secret": settings.get_password("client_secret")
-    }
+    url, headers = get_bav_request_config()
     
     # Get party name
     party_name = get_party_name_from_bank(bank)
@@ -76,229 +188,76 @@ def verify_bank_account_button(bank_account_name):
     
     # ✅ V2 API payload (name and phone are optional but recommended)
     payload = {
-        "bank_account": bank.bank_account_no,
+        "bank_account": account_no,
         "ifsc": ifsc,
         "name": party_name,  # Optional - enables name matching
         "phone": phone       # Optional
     }
     
     try:
-        frappe.logger().info(f"Calling Cashfree BAV V2 Sync for {bank_account_name}")
+        if frappe.conf.developer_mode:
+            frappe.logger().debug(f"Calling Cashfree BAV V2 Sync for {bank_account_name}")
         
-        resp = requests.post(url, json=payload, headers=headers, timeout=30)
+        status_code, data, resp_text = post_bav_sync(url, payload, headers)
         
-        # Log the request and response
-        frappe.log_error(
-            frappe.as_json({
-                "api_version": "V2",
-                "endpoint": url,
-                "payload": payload,
-                "response": resp.text[:1000],  # First 1000 chars
-                "status_code": resp.status_code
-            }),
-            f"Cashfree BAV V2 - {bank_account_name}"
+        # Log the request and response in the background
+        frappe.enqueue(
+            "cashfree_integration.api.bav._log_bav_call",
+            queue="short",
+            bank_account_name=bank_account_name,
+            endpoint=url,
+            payload=payload,
+            response=resp_text[:1000],  # First 1000 chars
+            status_code=status_code
         )
         
-        # Parse response
-        try:
-            data = resp.json()
-        except:
-            frappe.throw(f"Invalid JSON response from Cashfree: {resp.text[:200]}")
+        if data is None:
+            frappe.throw(f"Invalid JSON response from Cashfree: {resp_text[:200]}")
         
-        # ✅ V2 API returns 200 for both success and failure
-        # Check account_status field to determine result
-        if resp.status_code == 200:
-            # Extract V2 response fields
-            reference_id = data.get("reference_id", "")
-            name_at_bank = data.get("name_at_bank", "")
-            bank_name = data.get("bank_name", "")
-            branch = data.get("branch", "")
-            city = data.get("city", "")
-            micr = data.get("micr", "")
-            account_status = data.get("account_status", "")
-            account_status_code = data.get("account_status_code", "")
-            name_match_score = data.get("name_match_score")
-            name_match_result = data.get("name_match_result", "")
-            utr = data.get("utr", "")
-            ifsc_details = data.get("ifsc_details", {})
-            
-            # ✅ Check if account is VALID
-            if account_status == "VALID":
-                # ✅ SUCCESS - Update Bank Account
-                
-                # Check name match score if available
-                name_match_warning = ""
-                name_match_display = "Not Available"
-                
-                if name_match_score is not None and str(name_match_score).strip() not in ["", "null", "None"]:
-                    try:
-                        match_score_float = float(name_match_score)
-                        name_match_display = f"{match_score_float}%"
-                        
-                        if match_score_float < 70:
-                            name_match_warning = f"\n\n⚠️ NAME MATCH WARNING:\nScore {match_score_float}% is below 70%. Manual review recommended."
-                    except:
-                        name_match_display = "Not Available"
-                        name_match_warning = "\n\n✓ NAME MATCH: Score parsing failed (account verification successful)"
-                else:
-                    name_match_warning = "\n\n✓ NAME MATCH: Not performed by bank (account verification successful)"
-                
-                # Update account_name with name_at_bank
-                if name_at_bank:
-                    bank.account_name = name_at_bank
-                
-                # Update bank name if different
-                if bank_name:
-                    try:
-                        existing_banks = frappe.get_all("Bank", filters={"bank_name": bank_name}, limit=1)
-                        if existing_banks:
-                            bank.bank = bank_name
-                        else:
-                            # Try to find bank by partial match
-                            banks = frappe.get_all("Bank", fields=["name", "bank_name"])
-                            for b in banks:
-                                if bank_name.upper() in b.bank_name.upper() or b.bank_name.upper() in bank_name.upper():
-                                    bank.bank = b.name
-                                    break
-                    except:
-                        pass
-                
-                # Confirm IFSC
-                if ifsc:
-                    bank.branch_code = ifsc
-                    bank.custom_ifsc_code = ifsc
-                
-                # Set verification status
-                bank.custom_bank_account_approval_status = "Approved"
-                bank.custom_bank_account_verified = 1
-                bank.custom_verified_by = frappe.session.user  # ✅ FIXED: Use current user, not string
-                
-                # Build verification notes
-                bank.custom_verification_notesreason = (
-                    f"✅ Bank Account Verified Successfully (BAV V2 - Cashfree API)\n\n"
-                    f"═══════════════════════════════════\n"
-                    f"VERIFICATION DETAILS\n"
-                    f"═══════════════════════════════════\n"
-                    f"Verification Method: Cashfree BAV V2 Sync API\n"
-                    f"Reference ID: {reference_id}\n"
-                    f"Verified Via: Cashfree Bank Account Verification\n"
-                    f"Initiated By: {frappe.session.user}\n"
-                    f"Timestamp: {now()}\n"
-                    f"UTR: {utr or 'N/A'}\n\n"
-                    f"═══════════════════════════════════\n"
-                    f"BANK DETAILS (FROM BANK)\n"
-                    f"═══════════════════════════════════\n"
-                    f"Bank Name: {bank_name}\n"
-                    f"Branch: {branch}\n"
-                    f"City: {city}\n"
-                    f"MICR: {micr}\n"
-                    f"Name at Bank: {name_at_bank}\n"
-                    f"Account Status: {account_status}\n"
-                    f"Status Code: {account_status_code}\n\n"
-                    f"═══════════════════════════════════\n"
-                    f"NAME VERIFICATION\n"
-                    f"═══════════════════════════════════\n"
-                    f"Submitted Name: {party_name}\n"
-                    f"Bank Records Show: {name_at_bank}\n"
-                    f"Match Score: {name_match_display}\n"
-                    f"Match Result: {name_match_result or 'Not Performed'}"
-                    f"{name_match_warning}\n\n"
-                    f"═══════════════════════════════════\n"
-                    f"ACTIONS TAKEN\n"
-                    f"═══════════════════════════════════\n"
-                    f"✓ Account Name updated to: {name_at_bank}\n"
-                    f"✓ Bank Name: {bank.bank}\n"
-                    f"✓ IFSC Code confirmed: {ifsc}\n"
-                    f"✓ Verification Status: Approved\n"
-                    f"✓ Account marked as verified by Cashfree API"
-                )
-                
-                bank.flags.ignore_permissions = True
-                bank.flags.ignore_validate = True
-                bank.flags.ignore_mandatory = True
-                bank.save()
-                frappe.db.commit()
-                
-                # Build success message
-                name_warning_html = name_match_warning.replace('\n', '<br>') if name_match_warning else ""
-                
-                frappe.msgprint(
-                    f"✅ <b>Bank Account Verified & Updated</b><br><br>"
-                    f"<div style='background: #d4edda; padding: 15px; border-left: 4px solid #28a745; margin: 10px 0;'>"
-                    f"<b>Account Number:</b> {bank.bank_account_no}<br>"
-                    f"<b>Bank Name:</b> {bank_name}<br>"
-                    f"<b>Branch:</b> {branch}<br>"
-                    f"<b>Name at Bank:</b> {name_at_bank}<br>"
-                    f"<b>Match Score:</b> {name_match_display}<br>"
-                    f"<b>Status:</b> {account_status}"
-                    f"</div><br>"
-                    f"<b>Reference ID:</b> {reference_id}"
-                    f"{name_warning_html}",
-                    indicator='green',
-                    title='Verification Successful'
-                )
-                
-                return {"success": True, "message": "Verified", "data": data}
-            
-            else:
-                # ❌ FAILURE - Account not VALID
-                bank.custom_bank_account_approval_status = "Draft"
-                bank.custom_bank_account_verified = 0
-                
-                failure_reason = f"Account Status: {account_status} ({account_status_code})"
-                
-                bank.custom_verification_notesreason = (
-                    f"❌ Bank Account Verification Failed (BAV V2)\n\n"
-                    f"Reference ID: {reference_id}\n"
-                    f"Initiated By: {frappe.session.user}\n"
-                    f"Timestamp: {now()}\n\n"
-                    f"FAILURE REASON:\n{failure_reason}\n\n"
-                    f"Bank Details:\n"
-                    f"Name at Bank: {name_at_bank or 'N/A'}\n"
-                    f"Submitted: {party_name}\n"
-                    f"Account Status: {account_status}"
-                )
-                
-                bank.flags.ignore_permissions = True
-                bank.flags.ignore_validate = True
-                bank.flags.ignore_mandatory = True
-                bank.save()
-                frappe.db.commit()
-                
-                frappe.msgprint(
-                    f"❌ <b>Verification Failed</b><br><br>"
-                    f"<b>Reason:</b> {failure_reason}",
-                    indicator='red',
-                    title='Verification Failed'
-                )
-                
-                return {"success": False, "message": "Failed", "data": data}
+        result = apply_bav_response(bank, ifsc, party_name, status_code, data)
+        save_verified_bank_account(bank)
+        frappe.db.commit()
         
-        else:
-            # API returned non-200 status
-            code, friendly_error = _extract_cashfree_error(data, resp.status_code)
-            
-            bank.custom_bank_account_approval_status = "Draft"
-            bank.custom_bank_account_verified = 0
-            bank.custom_verification_notesreason = f"❌ API Error ({code})\n\n{friendly_error}"
+        if result.get("api_error"):
+            frappe.throw(f"Cashfree API Error: {result['message']}")
+        
+        if result["success"]:
+            # Build success message
+            name_match_warning = result["name_match_warning"]
+            name_warning_html = name_match_warning.replace('\n', '<br>') if name_match_warning else ""
             
-            bank.flags.ignore_permissions = True
-            bank.flags.ignore_validate = True
-            bank.flags.ignore_mandatory = True
-            bank.save()
-            frappe.db.commit()
+            frappe.msgprint(
+                _MSGPRINT_TEMPLATE.format_map({
+                    "account_number": bank.bank_account_no,
+                    "bank_name": data.get("bank_name", ""),
+                    "branch": data.get("branch", ""),
+                    "name_at_bank": data.get("name_at_bank", ""),
+                    "name_match_display": result["name_match_display"],
+                    "account_status": data.get("account_status", ""),
+                    "reference_id": data.get("reference_id", ""),
+                    "name_warning_html": name_warning_html
+                }),
+                indicator='green',
+                title='Verification Successful'
+            )
             
-            frappe.throw(f"Cashfree API Error: {friendly_error}")
+            return {"success": True, "message": "Verified", "data": data}
+        
+        frappe.msgprint(
+            f"❌ <b>Verification Failed</b><br><br>"
+            f"<b>Reason:</b> {result['failure_reason']}",
+            indicator='red',
+            title='Verification Failed'
+        )
+        
+        return {"success": False, "message": "Failed", "data": data}
     
     except requests.exceptions.RequestException as e:
         bank.custom_bank_account_approval_status = "Draft"
         bank.custom_bank_account_verified = 0
         bank.custom_verification_notesreason = f"❌ Network Error\n\n{str(e)}"
         
-        bank.flags.ignore_permissions = True
-        bank.flags.ignore_validate = True
-        bank.flags.ignore_mandatory = True
-        bank.save()
+        save_verified_bank_account(bank)
         frappe.db.commit()
         
         frappe.throw(f"Network error: {str(e)}")
@@ -308,6 +267,368 @@ def verify_bank_account_button(bank_account_name):
         frappe.throw(f"Verification failed: {str(e)}")
 
 
+def validate_bank_details(account_no, ifsc):
+    """
+    Normalize and validate an account number / IFSC pair
+    
+    Returns:
+        tuple: (error message or None, stripped account number, stripped upper-case IFSC)
+        - callers should send the normalized values, not the raw ones
+    """
+    account_no = str(account_no or "").strip()
+    ifsc = str(ifsc or "").strip().upper()
+    
+    if not _ACCT_RE.match(account_no):
+        return "Invalid account number format (expected 9-18 digits)", account_no, ifsc
+    
+    if not _IFSC_RE.match(ifsc):
+        return "Invalid IFSC format (expected e.g. HDFC0001234)", account_no, ifsc
+    
+    return None, account_no, ifsc
+
+
+def _log_bav_call(bank_account_name, endpoint, payload, response, status_code):
+    """Background job: record a BAV request/response in the Error Log"""
+    frappe.log_error(
+        _json_dumps({
+            "api_version": "V2",
+            "endpoint": endpoint,
+            "payload": payload,
+            "response": response,
+            "status_code": status_code
+        }),
+        f"Cashfree BAV V2 - {bank_account_name}"
+    )
+
+
+def _bank_index(ttl=600):
+    """
+    Return {UPPER(bank_name): name} for every Bank
+    Memoized per site for `ttl` seconds; cleared by the Bank on_update / on_trash hooks.
+    """
+    entry = _BANK_INDEX.get(frappe.local.site)
+    if entry and time.monotonic() < entry["expires"]:
+        return entry["map"]
+    
+    index = {
+        row.bank_name.upper(): row.name
+        for row in frappe.get_all("Bank", fields=["name", "bank_name"])
+        if row.bank_name
+    }
+    _BANK_INDEX[frappe.local.site] = {"map": index, "expires": time.monotonic() + ttl}
+    
+    return index
+
+
+def clear_bank_index(doc=None, method=None):
+    """Drop the memoized Bank index for the current site"""
+    _BANK_INDEX.pop(frappe.local.site, None)
+
+
+def _get_cached_settings(ttl=300):
+    """
+    Return (base_url, client_id, client_secret, verification_base) for Cashfree
+    Memoized per site for `ttl` seconds so bulk runs don't re-read and decrypt
+    Cashfree Settings for every account. The shared settings version is checked on
+    every call, so a save (e.g. a rotated secret) reaches all workers at once.
+    """
+    version = get_settings_version()
+    entry = _settings_cache.get(frappe.local.site)
+    if entry and entry["version"] == version and time.monotonic() < entry["expires"]:
+        return entry["value"]
+    
+    settings = frappe.get_single("Cashfree Settings")
+    
+    # ✅ BAV V2 API uses different base URL than Payouts
+    # Sandbox: https://sandbox.cashfree.com/verification
+    # Production: https://api.cashfree.com/verification
+    
+    # Determine environment from settings
+    if settings.environment == "Sandbox":
+        verification_base = "https://sandbox.cashfree.com/verification"
+    else:
+        verification_base = "https://api.cashfree.com/verification"
+    
+    value = (
+        settings.get_base_url("payout"),
+        settings.client_id,
+        settings.get_password("client_secret"),
+        verification_base
+    )
+    _settings_cache[frappe.local.site] = {
+        "value": value, "version": version, "expires": time.monotonic() + ttl
+    }
+    
+    return value
+
+
+def get_settings_version():
+    """Current shared Cashfree Settings version (None until the settings are first saved)"""
+    return frappe.cache().get_value(SETTINGS_VERSION_KEY)
+
+
+def _bump_settings_version():
+    frappe.cache().set_value(SETTINGS_VERSION_KEY, frappe.generate_hash(length=10))
+
+
+def clear_settings_cache():
+    """
+    Invalidate memoized Cashfree settings for the current site on every worker
+    The version is bumped now and again after commit, so a worker that re-read
+    the old settings before the save committed doesn't keep that copy.
+    """
+    _settings_cache.pop(frappe.local.site, None)
+    _bump_settings_version()
+    frappe.db.after_commit.add(_bump_settings_version)
+
+
+def get_client_secret():
+    """Decrypted Cashfree client_secret, from the memoized credentials"""
+    return _get_cached_settings()[2]
+
+
+def get_bav_request_config():
+    """Build the BAV V2 Sync URL and auth headers from Cashfree Settings"""
+    settings_value = _get_cached_settings()
+    
+    cached = _request_config_cache.get(frappe.local.site)
+    if cached and cached[0] is settings_value:
+        return cached[1]
+    
+    base_url, client_id, client_secret, verification_base = settings_value
+    
+    # Use Sync API for instant results
+    url = f"{verification_base}/bank-account/sync"
+    
+    headers = {
+        "Content-Type": "application/json",
+        "x-client-id": client_id,
+        "x-client-secret": client_secret
+    }
+    
+    _request_config_cache[frappe.local.site] = (settings_value, (url, headers))
+    
+    return url, headers
+
+
+def post_bav_sync(url, payload, headers, site=None):
+    """
+    Call the BAV V2 Sync API and return (status_code, data, text)
+    Pure HTTP - no frappe.db access, so it is safe to run from a worker thread.
+    data is None when the body is not valid JSON.
+    Concurrent calls for the same account + IFSC share a single request, but only
+    within one site and client id and for the same name/phone, since the result
+    depends on whose credentials made the call and name_match_score is computed
+    against the name sent. Worker threads have no frappe.local, so they
+    must pass `site` in.
+    """
+    key = hashlib.blake2b(
+        "|".join((
+            site or frappe.local.site, url, headers.get("x-client-id") or "",
+            payload["bank_account"], payload["ifsc"],
+            payload.get("name") or "", payload.get("phone") or ""
+        )).encode(),
+        digest_size=16
+    ).hexdigest()
+    
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _inflight[key] = future
+    
+    if not is_owner:
+        # Leave room for the owner's connect retries on top of its own timeout
+        return future.result(timeout=30)
+    
+    try:
+        resp = _session.post(url, json=payload, headers=headers, timeout=BAV_TIMEOUT)
+        
+        try:
+            data = _json_loads(resp.content)
+        except ValueError:
+            data = None
+        
+        result = (resp.status_code, data, resp.text)
+        future.set_result(result)
+        return result
+    
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def post_bav_sync_many(payloads, url, headers):
+    """
+    Fan out BAV V2 Sync calls over a thread pool sharing the module session
+    
+    Args:
+        payloads: dict of {bank_account_name: payload}
+    
+    Returns:
+        dict of {bank_account_name: (status_code, data, text) or the raised exception}
+    """
+    responses = {}
+    site = frappe.local.site
+    
+    with ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS) as pool:
+        futures = {
+            pool.submit(post_bav_sync, url, payload, headers, site): name
+            for name, payload in payloads.items()
+        }
+        
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                responses[name] = future.result()
+            except Exception as e:
+                responses[name] = e
+    
+    return responses
+
+
+def apply_bav_response(bank, ifsc, party_name, status_code, data):
+    """
+    Write a BAV V2 Sync response onto the Bank Account (does not save)
+    
+    Returns:
+        dict: {success, message, ...} - api_error is set for non-200 responses
+    """
+    # ✅ V2 API returns 200 for both success and failure
+    # Check account_status field to determine result
+    if status_code != 200:
+        # API returned non-200 status
+        code, friendly_error = _extract_cashfree_error(data, status_code)
+        
+        bank.custom_bank_account_approval_status = "Draft"
+        bank.custom_bank_account_verified = 0
+        bank.custom_verification_notesreason = f"❌ API Error ({code})\n\n{friendly_error}"
+        
+        return {"success": False, "message": friendly_error, "error_code": code, "api_error": True}
+    
+    # Extract V2 response fields
+    (
+        reference_id, name_at_bank, bank_name, branch, city, micr,
+        account_status, account_status_code, name_match_result, utr
+    ) = [data.get(key, "") for key in _BAV_TEXT_FIELDS]
+    name_match_score = data.get("name_match_score")
+    name_match_score = "" if name_match_score is None else str(name_match_score).strip()
+    
+    # ✅ Check if account is VALID
+    if account_status == "VALID":
+        # ✅ SUCCESS - Update Bank Account
+        
+        # Check name match score if available
+        name_match_display = "Not Available"
+        
+        if name_match_score in ("", "null", "None"):
+            name_match_warning = "\n\n✓ NAME MATCH: Not performed by bank (account verification successful)"
+        else:
+            try:
+                match_score_float = float(name_match_score)
+            except (TypeError, ValueError):
+                name_match_warning = "\n\n✓ NAME MATCH: Score parsing failed (account verification successful)"
+            else:
+                name_match_display = f"{match_score_float}%"
+                name_match_warning = (
+                    f"\n\n⚠️ NAME MATCH WARNING:\nScore {match_score_float}% is below 70%. Manual review recommended."
+                    if match_score_float < 70 else ""
+                )
+        
+        # Update account_name with name_at_bank
+        if name_at_bank:
+            bank.account_name = name_at_bank
+        
+        # Update bank name if different
+        if bank_name:
+            try:
+                index = _bank_index()
+                bank_name_upper = bank_name.upper()
+                
+                match = index.get(bank_name_upper)
+                if not match:
+                    # Try to find bank by partial match (either name contains the other)
+                    match = next(
+                        (name for key, name in index.items() if bank_name_upper in key or key in bank_name_upper),
+                        None
+                    )
+                if match:
+                    bank.bank = match
+            except:
+                pass
+        
+        # Confirm IFSC
+        if ifsc:
+            bank.branch_code = ifsc
+            bank.custom_ifsc_code = ifsc
+        
+        # Set verification status
+        bank.custom_bank_account_approval_status = "Approved"
+        bank.custom_bank_account_verified = 1
+        bank.custom_verified_by = frappe.session.user  # ✅ FIXED: Use current user, not string
+        
+        # Build verification notes
+        bank.custom_verification_notesreason = _NOTES_TEMPLATE.format_map({
+            "reference_id": reference_id,
+            "user": frappe.session.user,
+            "timestamp": now(),
+            "utr": utr or "N/A",
+            "bank_name": bank_name,
+            "branch": branch,
+            "city": city,
+            "micr": micr,
+            "name_at_bank": name_at_bank,
+            "account_status": account_status,
+            "account_status_code": account_status_code,
+            "party_name": party_name,
+            "name_match_display": name_match_display,
+            "name_match_result": name_match_result or "Not Performed",
+            "name_match_warning": name_match_warning,
+            "bank": bank.bank,
+            "ifsc": ifsc
+        })
+        
+        return {
+            "success": True,
+            "message": "Verified",
+            "name_match_display": name_match_display,
+            "name_match_warning": name_match_warning
+        }
+    
+    # ❌ FAILURE - Account not VALID
+    bank.custom_bank_account_approval_status = "Draft"
+    bank.custom_bank_account_verified = 0
+    
+    failure_reason = f"Account Status: {account_status} ({account_status_code})"
+    
+    bank.custom_verification_notesreason = (
+        f"❌ Bank Account Verification Failed (BAV V2)\n\n"
+        f"Reference ID: {reference_id}\n"
+        f"Initiated By: {frappe.session.user}\n"
+        f"Timestamp: {now()}\n\n"
+        f"FAILURE REASON:\n{failure_reason}\n\n"
+        f"Bank Details:\n"
+        f"Name at Bank: {name_at_bank or 'N/A'}\n"
+        f"Submitted: {party_name}\n"
+        f"Account Status: {account_status}"
+    )
+    
+    return {"success": False, "message": "Failed", "failure_reason": failure_reason}
+
+
+def save_verified_bank_account(bank):
+    """Save Bank Account verification fields, skipping validation and permissions"""
+    bank.flags.ignore_permissions = True
+    bank.flags.ignore_validate = True
+    bank.flags.ignore_mandatory = True
+    bank.save()
+
+
 def _extract_cashfree_error(data, status_code):
     """Extract and format Cashfree error messages"""
     msg = (
@@ -334,20 +655,55 @@ def _extract_cashfree_error(data, status_code):
     )
 
 
-def get_party_name_from_bank(bank):
-    """Get party name for verification"""
+def get_party_name_from_bank(bank, party_names=None):
+    """
+    Get party name for verification
+    Pass party_names from prefetch_party_names to skip the per-account lookup
+    """
     if bank.party:
+        if party_names is not None:
+            name = party_names.get((bank.party_type, bank.party))
+        else:
+            try:
+                name = frappe.db.get_value(
+                    bank.party_type, bank.party, _PARTY_NAME_FIELDS.get(bank.party_type, "name")
+                )
+            except:
+                name = None
+        
+        if name:
+            return name
+    return bank.account_name or bank.party or ""
+
+
+def prefetch_party_names(banks):
+    """
+    Load party display names for many Bank Accounts, one query per party type
+    
+    Returns:
+        dict of {(party_type, party): display name}
+    """
+    parties_by_type = {}
+    for bank in banks:
+        if bank.party_type and bank.party:
+            parties_by_type.setdefault(bank.party_type, set()).add(bank.party)
+    
+    party_names = {}
+    for party_type, parties in parties_by_type.items():
+        field = _PARTY_NAME_FIELDS.get(party_type, "name")
         try:
-            party_doc = frappe.get_doc(bank.party_type, bank.party)
-            if hasattr(party_doc, 'supplier_name'):
-                return party_doc.supplier_name
-            elif hasattr(party_doc, 'customer_name'):
-                return party_doc.customer_name
-            else:
-                return party_doc.name
+            rows = frappe.get_all(
+                party_type,
+                filters={"name": ["in", list(parties)]},
+                fields=["name", f"{field} as display_name"]
+            )
         except:
-            pass
-    return bank.account_name or bank.party or ""
+            continue
+        
+        for row in rows:
+            party_names[(party_type, row.name)] = row.display_name
+    
+    return party_names
 
 
 def get_contact_details_from_bank(bank):
@@ -356,23 +712,22 @@ def get_contact_details_from_bank(bank):
     phone = ""
     
     try:
-        contacts = frappe.get_all(
-            "Dynamic Link",
-            filters={
-                "link_doctype": "Bank Account",
-                "link_name": bank.name,
-                "parenttype": "Contact"
-            },
-            fields=["parent"]
-        )
+        # Contact email + first phone in one query (no full Contact load)
+        row = frappe.db.sql("""
+            SELECT c.email_id, p.phone
+            FROM `tabDynamic Link` dl
+            JOIN `tabContact` c ON c.name = dl.parent
+            LEFT JOIN `tabContact Phone` p
+                ON p.parent = c.name AND p.parenttype = 'Contact' AND p.idx = 1
+            WHERE dl.parenttype = 'Contact'
+                AND dl.link_doctype = 'Bank Account'
+                AND dl.link_name = %s
+            LIMIT 1
+        """, bank.name, as_dict=True)
         
-        if contacts:
-            contact_name = contacts[0].parent
-            contact = frappe.get_doc("Contact", contact_name)
-            email = contact.email_id or ""
-            phone_nos = contact.get('phone_nos', [])
-            if phone_nos:
-                phone = phone_nos[0].phone or ""
+        if row:
+            email = row[0].email_id or ""
+            phone = row[0].phone or ""
     except:
         pass
     
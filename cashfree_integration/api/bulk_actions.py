@@ -1,8 +1,29 @@
 # bulk_actions.py
+import functools
+from contextlib import contextmanager
+
 import frappe
-from frappe import _
+from frappe import _, parse_json
+from frappe.model.workflow import get_workflow_name
+from frappe.utils import get_fullname, now
+from frappe.utils.caching import request_cache
 from frappe.utils.password import check_password
 
+# Payment Requests written per bulk UPDATE statement
+BULK_CHUNK_SIZE = 100
+
+# Reconciliation statuses (upper-cased) that allow a payout to be queued again
+FAILED_PAYOUT_STATES = frozenset({"FAILED", "REVERSED", "REJECTED"})
+
+# Transfer modes accepted for bulk payouts
+VALID_TRANSFER_MODES = ("NEFT", "RTGS", "IMPS", "UPI")
+
+# Workflow states a Payment Request can no longer be rejected from
+_UNREJECTABLE_STATES = frozenset({"Paid", "Rejected"})
+
+# Rows saved between commits in the per-row bulk workers
+BULK_COMMIT_EVERY = 50
+
 
 def verify_password(password):
     """Verify user password for 2FA"""
@@ -21,293 +42,530 @@ def check_user_role(required_roles):
     Returns:
         True if user has at least one role, False otherwise
     """
-    user_roles = frappe.get_roles(frappe.session.user)
-    
-    for role in required_roles:
-        if role in user_roles:
-            return True
+    return bool(_cached_user_roles(frappe.session.user) & set(required_roles))
+
+
+@request_cache
+def _cached_user_roles(user):
+    """User's roles as a set, looked up once per request"""
+    return frozenset(frappe.get_roles(user))
+
+
+def require_roles(roles, message):
+    """
+    Deny the call unless the user has at least one of `roles`
+    Runs before the wrapped endpoint parses its payload.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not check_user_role(roles):
+                frappe.throw(_(message))
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _parse_payment_requests(payment_requests):
+    """Accept a list or JSON array of names; drop duplicates, keeping the first occurrence"""
+    return list(dict.fromkeys(parse_json(payment_requests)))
+
+
+def _prefetch_payment_requests(payment_requests, fields):
+    """Load the given Payment Request columns for every name in one query, keyed by name"""
+    return {
+        r.name: r for r in frappe.get_all(
+            "Payment Request",
+            filters={"name": ["in", payment_requests]},
+            fields=["name", *fields]
+        )
+    }
+
+
+def _allowed_from_states(to_state):
+    """
+    Workflow states the current user may move a Payment Request from into `to_state`
+    Returns None when Payment Request has no active workflow. Transition conditions
+    are not evaluated, only the state pair and the allowed role.
+    """
+    workflow_name = get_workflow_name("Payment Request")
+    if not workflow_name:
+        return None
     
-    return False
+    roles = _cached_user_roles(frappe.session.user)
+    return {
+        t.state for t in frappe.get_cached_doc("Workflow", workflow_name).transitions
+        if t.next_state == to_state and t.allowed in roles
+    }
 
 
-@frappe.whitelist()
-def bulk_verify_requests(payment_requests):
+def _bulk_add_comments(comment_type, contents):
     """
-    Bulk verify payment requests
-    Changes workflow state from Draft → Verified
-    ONLY Accounts Manager can execute
+    Add a timeline Comment to each Payment Request in one insert
+    Plain "Comment" rows are also pushed to open forms after commit, in the same
+    per-document docinfo_update shape Comment.notify_change uses.
+    
+    Args:
+        contents: {pr_name: comment content}
     """
-    # ROLE CHECK
-    if not check_user_role(['Accounts Manager']):
-        frappe.throw(_("Access Denied: Only Accounts Manager can verify payment requests"))
+    if not contents:
+        return
+    
+    user = frappe.session.user
+    comment_by = get_fullname(user)
+    timestamp = now()
+    
+    comments = [
+        frappe._dict(
+            name=frappe.generate_hash(length=10), creation=timestamp, modified=timestamp,
+            owner=user, modified_by=user, comment_type=comment_type,
+            reference_doctype="Payment Request", reference_name=pr_name,
+            content=content, comment_email=user, comment_by=comment_by
+        )
+        for pr_name, content in contents.items()
+    ]
+    fields = list(comments[0])
     
-    import json
-    if isinstance(payment_requests, str):
-        payment_requests = json.loads(payment_requests)
+    frappe.db.bulk_insert(
+        "Comment",
+        fields=fields,
+        values=[tuple(c[f] for f in fields) for c in comments],
+        chunk_size=500
+    )
     
+    if comment_type == "Comment":
+        for comment in comments:
+            frappe.publish_realtime(
+                "docinfo_update",
+                {"doc": comment, "key": "comments", "action": "add"},
+                doctype=comment.reference_doctype,
+                docname=comment.reference_name,
+                after_commit=True
+            )
+
+
+def _bulk_transition(payment_requests, to_state, skip_reason):
+    """
+    Move Payment Requests to another workflow state without loading each doc
+    Each row's current state is checked against the workflow's transitions for the
+    user's roles; eligible rows are flipped with one bulk UPDATE per chunk, get a
+    Workflow comment on their timeline (the audit trail save() would have left),
+    and everything is committed once.
+    
+    Args:
+        skip_reason: callable(current_state) -> reason string to skip, or None if eligible
+    
+    Returns:
+        dict: {success: [names], failed: [{name, error}], skipped: [{name, reason}]}
+    """
     results = {"success": [], "failed": [], "skipped": []}
     
+    rows = _prefetch_payment_requests(payment_requests, ["workflow_state"])
+    allowed_from = _allowed_from_states(to_state)
+    
+    eligible = []
     for pr_name in payment_requests:
-        try:
-            pr = frappe.get_doc("Payment Request", pr_name)
-            
-            # Check if in Draft state
-            if pr.workflow_state != "Draft":
-                results["skipped"].append({
-                    "name": pr_name,
-                    "reason": f"Not in Draft state (current: {pr.workflow_state})"
-                })
-                continue
-            
-            # Apply workflow action
-            pr.workflow_state = "Verified"
-            pr.save(ignore_permissions=True)
-            frappe.db.commit()
-            
-            results["success"].append(pr_name)
-            
-        except Exception as e:
+        if pr_name not in rows:
             results["failed"].append({
                 "name": pr_name,
-                "error": str(e)
+                "error": f"Payment Request {pr_name} not found"
             })
-            frappe.log_error(frappe.get_traceback(), f"Bulk Verify Failed - {pr_name}")
+            continue
+        
+        state = rows[pr_name].workflow_state
+        reason = skip_reason(state)
+        if not reason and allowed_from is not None and state not in allowed_from:
+            reason = f"No workflow transition from {state} to {to_state} for your role"
+        
+        if reason:
+            results["skipped"].append({
+                "name": pr_name,
+                "reason": reason
+            })
+        else:
+            eligible.append(pr_name)
+    
+    # bulk_update stamps modified/modified_by itself
+    values = {"workflow_state": to_state}
+    
+    for start in range(0, len(eligible), BULK_CHUNK_SIZE):
+        chunk = eligible[start:start + BULK_CHUNK_SIZE]
+        
+        frappe.db.savepoint("bulk_transition")
+        try:
+            frappe.db.bulk_update(
+                "Payment Request", {pr_name: dict(values) for pr_name in chunk}, chunk_size=BULK_CHUNK_SIZE
+            )
+            results["success"].extend(chunk)
+        
+        except Exception:
+            # Bad chunk - fall back to row-by-row so one row can't fail the rest
+            frappe.db.rollback(save_point="bulk_transition")
+            
+            for pr_name in chunk:
+                try:
+                    frappe.db.set_value("Payment Request", pr_name, "workflow_state", to_state)
+                    results["success"].append(pr_name)
+                except Exception as e:
+                    results["failed"].append({
+                        "name": pr_name,
+                        "error": str(e)
+                    })
+                    frappe.log_error(frappe.get_traceback(), f"Bulk {to_state} Failed - {pr_name}")
+    
+    # Same Workflow comment apply_workflow adds, so the timeline shows who moved each row
+    _bulk_add_comments("Workflow", {pr_name: to_state for pr_name in results["success"]})
+    frappe.db.commit()
+    
+    return results
+
+
+@contextmanager
+def _batched_commit(batch_size=BULK_COMMIT_EVERY):
+    """
+    Commit once per `batch_size` saved rows instead of after every row
+    Yields atomic_row(): wraps one row in a savepoint so a failing row is rolled
+    back on its own and the rest of the batch still commits.
+    """
+    saved = 0
+    
+    @contextmanager
+    def atomic_row():
+        nonlocal saved
+        frappe.db.savepoint("bulk_row")
+        try:
+            yield
+        except Exception:
+            try:
+                frappe.db.rollback(save_point="bulk_row")
+            except Exception:
+                # A commit inside the row (e.g. the payout hook) already released it
+                pass
+            raise
+        
+        saved += 1
+        if saved % batch_size == 0:
+            frappe.db.commit()
+    
+    try:
+        yield atomic_row
+    finally:
+        frappe.db.commit()
+
+
+def _enqueue_bulk_job(method, prefix, payment_requests, **kwargs):
+    """Enqueue a bulk worker from this module on the long queue and return its job id"""
+    job_id = f"{prefix}-{frappe.generate_hash(length=8)}"
+    
+    frappe.enqueue(
+        f"cashfree_integration.api.bulk_actions.{method}",
+        queue="long",
+        timeout=1800,
+        job_name=job_id,
+        payment_requests=payment_requests,
+        user=frappe.session.user,
+        bulk_job_id=job_id,
+        **kwargs
+    )
+    
+    return {"job_id": job_id, "total": len(payment_requests)}
+
+
+def _publish_bulk_progress(job_id, done, total, user):
+    """Push bulk job progress to the user every 10 rows (and on the last one)"""
+    if done % 10 == 0 or done == total:
+        frappe.publish_realtime(
+            "bulk_payout_progress",
+            {"job_id": job_id, "done": done, "total": total},
+            user=user
+        )
+
+
+def _store_bulk_result(job_id, results, user):
+    """Keep a finished bulk job's results for an hour and tell the user it's done"""
+    frappe.cache().set_value(
+        f"bulk_result:{job_id}", {"user": user, "results": results}, expires_in_sec=3600
+    )
+    frappe.publish_realtime("bulk_payout_complete", {"job_id": job_id}, user=user)
+
+
+@frappe.whitelist()
+def get_bulk_result(job_id):
+    """
+    Results of a background bulk queue/retry job
+    Returns None while the job is still running
+    """
+    entry = frappe.cache().get_value(f"bulk_result:{job_id}")
+    if not entry:
+        return None
+    
+    if entry["user"] != frappe.session.user:
+        frappe.throw(_("Not permitted"), frappe.PermissionError)
+    
+    return entry["results"]
+
+
+@frappe.whitelist()
+@require_roles(['Accounts Manager'], "Access Denied: Only Accounts Manager can verify payment requests")
+def bulk_verify_requests(payment_requests):
+    """
+    Bulk verify payment requests
+    Changes workflow state from Draft → Verified
+    ONLY Accounts Manager can execute
+    """
+    payment_requests = _parse_payment_requests(payment_requests)
+    
+    results = _bulk_transition(
+        payment_requests, "Verified",
+        lambda state: None if state == "Draft" else f"Not in Draft state (current: {state})"
+    )
     
     summary = f"✅ Verified: {len(results['success'])} | ❌ Failed: {len(results['failed'])} | ⚠️ Skipped: {len(results['skipped'])}"
     return summary
 
 
 @frappe.whitelist()
+@require_roles(['Accounts Manager'], "Access Denied: Only Accounts Manager can approve payment requests")
 def bulk_approve_payments(payment_requests):
     """
     Bulk approve payment requests
     Changes workflow state from Verified → Approved
     ONLY Accounts Manager can execute
     """
-    # ROLE CHECK
-    if not check_user_role(['Accounts Manager']):
-        frappe.throw(_("Access Denied: Only Accounts Manager can approve payment requests"))
+    payment_requests = _parse_payment_requests(payment_requests)
     
-    import json
-    if isinstance(payment_requests, str):
-        payment_requests = json.loads(payment_requests)
-    
-    results = {"success": [], "failed": [], "skipped": []}
-    
-    for pr_name in payment_requests:
-        try:
-            pr = frappe.get_doc("Payment Request", pr_name)
-            
-            # Check if in Verified state
-            if pr.workflow_state != "Verified":
-                results["skipped"].append({
-                    "name": pr_name,
-                    "reason": f"Not in Verified state (current: {pr.workflow_state})"
-                })
-                continue
-            
-            # Apply workflow action
-            pr.workflow_state = "Approved"
-            pr.save(ignore_permissions=True)
-            frappe.db.commit()
-            
-            results["success"].append(pr_name)
-            
-        except Exception as e:
-            results["failed"].append({
-                "name": pr_name,
-                "error": str(e)
-            })
-            frappe.log_error(frappe.get_traceback(), f"Bulk Approve Failed - {pr_name}")
+    results = _bulk_transition(
+        payment_requests, "Approved",
+        lambda state: None if state == "Verified" else f"Not in Verified state (current: {state})"
+    )
     
     summary = f"✅ Approved: {len(results['success'])} | ❌ Failed: {len(results['failed'])} | ⚠️ Skipped: {len(results['skipped'])}"
     return summary
 
 
 @frappe.whitelist()
+@require_roles(['Manager', 'Director'], "Access Denied: Only Manager or Director can queue payouts")
 def bulk_queue_payouts(payment_requests, password, transfer_mode):
     """
     Bulk queue payouts with 2FA verification
     Changes workflow state from Approved → Queued (triggers payout)
     ONLY Manager/Director can execute
     """
-    # ROLE CHECK
-    if not check_user_role(['Manager', 'Director']):
-        frappe.throw(_("Access Denied: Only Manager or Director can queue payouts"))
-    
-    import json
-    if isinstance(payment_requests, str):
-        payment_requests = json.loads(payment_requests)
+    payment_requests = _parse_payment_requests(payment_requests)
     
     # 2FA Verification
     if not verify_password(password):
         frappe.throw(_("Invalid password. Bulk payout requires authentication."))
     
     # Validate transfer mode
-    valid_modes = ["NEFT", "RTGS", "IMPS", "UPI"]
-    if transfer_mode not in valid_modes:
-        frappe.throw(_(f"Invalid transfer mode. Must be one of: {', '.join(valid_modes)}"))
+    if transfer_mode not in VALID_TRANSFER_MODES:
+        frappe.throw(_(f"Invalid transfer mode. Must be one of: {', '.join(VALID_TRANSFER_MODES)}"))
     
+    # Run in the background; the list view fetches get_bulk_result(job_id) on
+    # bulk_payout_complete and also polls it in case the event is missed
+    return _enqueue_bulk_job(
+        "_do_bulk_queue_payouts", "queue-payouts", payment_requests, transfer_mode=transfer_mode
+    )
+
+
+def _do_bulk_queue_payouts(payment_requests, transfer_mode, user, bulk_job_id):
+    """Background job for bulk_queue_payouts"""
     results = {"success": [], "failed": [], "skipped": []}
     
-    for pr_name in payment_requests:
-        try:
-            pr = frappe.get_doc("Payment Request", pr_name)
-            
-            # Check if in Approved state
-            if pr.workflow_state != "Approved":
-                results["skipped"].append({
-                    "name": pr_name,
-                    "reason": f"Not in Approved state (current: {pr.workflow_state})"
-                })
-                continue
-            
-            # Check if payout already exists (unless failed)
-            existing_payout = pr.get("custom_cashfree_payout_id")
-            recon_status = (pr.get("custom_reconciliation_status") or "").upper()
+    # Eligibility is decided from one prefetch; only rows being queued are loaded
+    rows = _prefetch_payment_requests(
+        payment_requests, ["workflow_state", "custom_cashfree_payout_id", "custom_reconciliation_status"]
+    )
+    
+    with _batched_commit() as atomic_row:
+        for i, pr_name in enumerate(payment_requests, 1):
+            _publish_bulk_progress(bulk_job_id, i, len(payment_requests), user)
             
-            if existing_payout and recon_status not in ["FAILED", "REVERSED", "REJECTED"]:
-                results["skipped"].append({
+            try:
+                row = rows.get(pr_name)
+                if not row:
+                    frappe.throw(_("Payment Request {0} not found").format(pr_name))
+                
+                # Check if in Approved state
+                if row.workflow_state != "Approved":
+                    results["skipped"].append({
+                        "name": pr_name,
+                        "reason": f"Not in Approved state (current: {row.workflow_state})"
+                    })
+                    continue
+                
+                # Check if payout already exists (unless failed)
+                existing_payout = row.custom_cashfree_payout_id
+                recon_status = (row.custom_reconciliation_status or "").upper()
+                
+                if existing_payout and recon_status not in FAILED_PAYOUT_STATES:
+                    results["skipped"].append({
+                        "name": pr_name,
+                        "reason": f"Payout already exists (ID: {existing_payout}, Status: {recon_status})"
+                    })
+                    continue
+                
+                with atomic_row():
+                    pr = frappe.get_doc("Payment Request", pr_name)
+                    
+                    # Set transfer mode
+                    pr.custom_transfer_mode = transfer_mode
+                    
+                    # Apply workflow action (triggers payout via hook)
+                    pr.workflow_state = "Queued"
+                    pr.save(ignore_permissions=True)
+                
+                results["success"].append(pr_name)
+                
+            except Exception as e:
+                results["failed"].append({
                     "name": pr_name,
-                    "reason": f"Payout already exists (ID: {existing_payout}, Status: {recon_status})"
+                    "error": str(e)
                 })
-                continue
-            
-            # Set transfer mode
-            pr.custom_transfer_mode = transfer_mode
-            
-            # Apply workflow action (triggers payout via hook)
-            pr.workflow_state = "Queued"
-            pr.save(ignore_permissions=True)
-            frappe.db.commit()
-            
-            results["success"].append(pr_name)
-            
-        except Exception as e:
-            results["failed"].append({
-                "name": pr_name,
-                "error": str(e)
-            })
-            frappe.log_error(frappe.get_traceback(), f"Bulk Queue Failed - {pr_name}")
+                frappe.log_error(frappe.get_traceback(), f"Bulk Queue Failed - {pr_name}")
     
-    # Return detailed results for frontend
-    return results
+    # Detailed results for frontend
+    _store_bulk_result(bulk_job_id, results, user)
 
 
 @frappe.whitelist()
+@require_roles(['Manager', 'Director'], "Access Denied: Only Manager or Director can retry payouts")
 def bulk_retry_payouts(payment_requests, password):
     """
     Bulk retry failed payouts with 2FA verification
     For Payment Requests in Failed/Reversed/Rejected reconciliation status
     ONLY Manager/Director can execute
     """
-    # ROLE CHECK
-    if not check_user_role(['Manager', 'Director']):
-        frappe.throw(_("Access Denied: Only Manager or Director can retry payouts"))
-    
-    import json
-    if isinstance(payment_requests, str):
-        payment_requests = json.loads(payment_requests)
+    payment_requests = _parse_payment_requests(payment_requests)
     
     # 2FA Verification
     if not verify_password(password):
         frappe.throw(_("Invalid password. Bulk retry requires authentication."))
     
+    # Run in the background; the list view fetches get_bulk_result(job_id) on
+    # bulk_payout_complete and also polls it in case the event is missed
+    return _enqueue_bulk_job("_do_bulk_retry_payouts", "retry-payouts", payment_requests)
+
+
+def _do_bulk_retry_payouts(payment_requests, user, bulk_job_id):
+    """Background job for bulk_retry_payouts"""
     results = {"success": [], "failed": [], "skipped": []}
     
+    # Eligibility is decided from one prefetch; only rows being retried are loaded
+    rows = _prefetch_payment_requests(payment_requests, ["custom_reconciliation_status"])
+    
+    eligible = {}
     for pr_name in payment_requests:
-        try:
-            pr = frappe.get_doc("Payment Request", pr_name)
-            
-            # Check if payout failed
-            recon_status = (pr.get("custom_reconciliation_status") or "").upper()
-            
-            if recon_status not in ["FAILED", "REVERSED", "REJECTED"]:
-                results["skipped"].append({
-                    "name": pr_name,
-                    "reason": f"Not in failed status (current: {recon_status})"
-                })
-                continue
-            
-            # Clear old payout data
-            frappe.db.set_value("Payment Request", pr_name, "custom_cashfree_payout_id", None, update_modified=False)
-            frappe.db.set_value("Payment Request", pr_name, "custom_utr_number", None, update_modified=False)
-            frappe.db.set_value("Payment Request", pr_name, "custom_reconciliation_status", "Pending", update_modified=False)
-            
-            # Reset to Approved state
-            pr.workflow_state = "Approved"
-            pr.save(ignore_permissions=True)
-            
-            # Queue again
-            pr.workflow_state = "Queued"
-            pr.save(ignore_permissions=True)
-            frappe.db.commit()
-            
-            results["success"].append(pr_name)
-            
-            frappe.log_error(
-                frappe.as_json({
-                    "pr": pr_name,
-                    "action": "Bulk retry",
-                    "user": frappe.session.user,
-                    "old_status": recon_status
-                }),
-                f"Bulk Retry - {pr_name}"
-            )
-            
-        except Exception as e:
+        row = rows.get(pr_name)
+        if not row:
             results["failed"].append({
                 "name": pr_name,
-                "error": str(e)
+                "error": f"Payment Request {pr_name} not found"
             })
-            frappe.log_error(frappe.get_traceback(), f"Bulk Retry Failed - {pr_name}")
+            continue
+        
+        # Check if payout failed
+        recon_status = (row.custom_reconciliation_status or "").upper()
+        
+        if recon_status not in FAILED_PAYOUT_STATES:
+            results["skipped"].append({
+                "name": pr_name,
+                "reason": f"Not in failed status (current: {recon_status})"
+            })
+            continue
+        
+        eligible[pr_name] = recon_status
     
-    # Return detailed results
-    return results
+    if eligible:
+        # Clear old payout data and reset to Approved for every eligible row at once.
+        # Approved is written here rather than saved, so each row needs only the one
+        # Queued save below; a row whose save fails is left Approved and can be re-queued.
+        pr_table = frappe.qb.DocType("Payment Request")
+        (
+            frappe.qb.update(pr_table)
+            .set(pr_table.custom_cashfree_payout_id, None)
+            .set(pr_table.custom_utr_number, None)
+            .set(pr_table.custom_reconciliation_status, "Pending")
+            .set(pr_table.workflow_state, "Approved")
+            .where(pr_table.name.isin(list(eligible)))
+        ).run()
+        frappe.db.commit()
+    
+    # Audit entries for successful retries, written to Error Log in one insert
+    audit_rows = []
+    
+    # Queue again - a real save so the payout hook fires
+    with _batched_commit() as atomic_row:
+        for i, (pr_name, recon_status) in enumerate(eligible.items(), 1):
+            _publish_bulk_progress(bulk_job_id, i, len(eligible), user)
+            
+            try:
+                with atomic_row():
+                    pr = frappe.get_doc("Payment Request", pr_name)
+                    pr.workflow_state = "Queued"
+                    pr.save(ignore_permissions=True)
+                
+                results["success"].append(pr_name)
+                
+                audit_rows.append((
+                    frappe.generate_hash(length=10), now(), now(), user, user,
+                    f"Bulk Retry - {pr_name}",
+                    frappe.as_json({
+                        "pr": pr_name,
+                        "action": "Bulk retry",
+                        "user": user,
+                        "old_status": recon_status
+                    })
+                ))
+                
+            except Exception as e:
+                results["failed"].append({
+                    "name": pr_name,
+                    "error": str(e)
+                })
+                frappe.log_error(frappe.get_traceback(), f"Bulk Retry Failed - {pr_name}")
+    
+    if audit_rows:
+        frappe.db.bulk_insert(
+            "Error Log",
+            fields=["name", "creation", "modified", "owner", "modified_by", "method", "error"],
+            values=audit_rows,
+            ignore_duplicates=True
+        )
+    
+    frappe.db.commit()
+    
+    # Detailed results
+    _store_bulk_result(bulk_job_id, results, user)
 
 
 @frappe.whitelist()
+@require_roles(['Manager', 'Director'], "Access Denied: Only Manager or Director can reject payment requests")
 def bulk_reject_requests(payment_requests, reason):
     """
     Bulk reject payment requests
     ONLY Manager/Director can execute
     """
-    # ROLE CHECK
-    if not check_user_role(['Manager', 'Director']):
-        frappe.throw(_("Access Denied: Only Manager or Director can reject payment requests"))
+    payment_requests = _parse_payment_requests(payment_requests)
     
-    import json
-    if isinstance(payment_requests, str):
-        payment_requests = json.loads(payment_requests)
+    # Cannot reject already paid or rejected
+    results = _bulk_transition(
+        payment_requests, "Rejected",
+        lambda state: f"Cannot reject (already {state})" if state in _UNREJECTABLE_STATES else None
+    )
     
-    results = {"success": [], "failed": [], "skipped": []}
+    # Rejection comments for every rejected request, written in one insert
+    user = frappe.session.user
     
-    for pr_name in payment_requests:
+    if results["success"]:
         try:
-            pr = frappe.get_doc("Payment Request", pr_name)
-            
-            # Cannot reject already paid or rejected
-            if pr.workflow_state in ["Paid", "Rejected"]:
-                results["skipped"].append({
-                    "name": pr_name,
-                    "reason": f"Cannot reject (already {pr.workflow_state})"
-                })
-                continue
-            
-            # Apply rejection
-            pr.workflow_state = "Rejected"
-            pr.add_comment("Comment", text=f"Rejected by {frappe.session.user}: {reason}")
-            pr.save(ignore_permissions=True)
+            _bulk_add_comments(
+                "Comment", {pr_name: f"Rejected by {user}: {reason}" for pr_name in results["success"]}
+            )
             frappe.db.commit()
-            
-            results["success"].append(pr_name)
-            
-        except Exception as e:
-            results["failed"].append({
-                "name": pr_name,
-                "error": str(e)
-            })
-            frappe.log_error(frappe.get_traceback(), f"Bulk Reject Failed - {pr_name}")
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), "Bulk Reject Comments Failed")
     
     summary = f"✅ Rejected: {len(results['success'])} | ❌ Failed: {len(results['failed'])} | ⚠️ Skipped: {len(results['skipped'])}"
     return summary
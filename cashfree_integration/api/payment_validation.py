@@ -1,5 +1,72 @@
 import frappe
 from frappe import _
+from frappe.utils import cint
+
+# Redis hash of {bank_account: {custom_bank_account_approval_status, custom_bank_account_verified}}
+BANK_VERIFY_STATUS_KEY = "bank_verify_status"
+
+# Redis hashes behind validate_po_payment_limit, keyed by Purchase Order:
+# PO grand_total, and {payment_request: grand_total} of its non-cancelled Payment Requests
+PO_GRAND_TOTAL_KEY = "po_grand_total"
+PO_PAYMENT_REQUESTS_KEY = "po_payment_requests"
+
+# Reconciliation status colours in the PO limit error
+STATUS_COLORS = {
+    "Success": "green",
+    "Pending": "orange",
+    "Failed": "red"
+}
+
+# Rendered only when a payment exceeds the PO total
+PO_EXCEEDS_TEMPLATE = """
+<div style="padding: 15px;">
+    <h4 style="color: red;">❌ Payment Exceeds Purchase Order Total</h4>
+    
+    <table class="table table-bordered" style="margin-top: 15px;">
+        <tr>
+            <th style="width: 50%;">Purchase Order Total</th>
+            <td><b>₹{{ po_total }}</b></td>
+        </tr>
+        <tr>
+            <th>Existing Payments</th>
+            <td>₹{{ existing_total }}</td>
+        </tr>
+        <tr>
+            <th>Current Payment</th>
+            <td>₹{{ current_payment }}</td>
+        </tr>
+        <tr style="background-color: #f8d7da;">
+            <th>Total Payments</th>
+            <td><b>₹{{ total_payments }}</b></td>
+        </tr>
+        <tr style="background-color: #f8d7da;">
+            <th>Excess Amount</th>
+            <td style="color: red;"><b>₹{{ excess_amount }}</b></td>
+        </tr>
+    </table>
+    
+    <div style="margin-top: 20px; padding: 15px; background-color: #fff3cd; border-left: 4px solid #ffc107;">
+        <h5>Options to Proceed:</h5>
+        <ol>
+            <li><b>Reduce Payment Amount</b> to ₹{{ allowed_amount }} or less</li>
+            <li><b>Enable Director Override</b> if this excess payment is authorized</li>
+            <li><b>Cancel/Modify</b> existing Payment Requests</li>
+        </ol>
+    </div>
+    
+    <div style="margin-top: 15px; padding: 10px; background-color: #d1ecf1; border-left: 4px solid #0c5460;">
+        <b>ℹ️ Existing Payment Requests ({{ existing_prs | length }}):</b><br>
+        <ul style="margin-top: 10px;">
+        {% for pr in existing_prs %}
+            <li>
+                <b>{{ pr.name }}</b>: ₹{{ pr.amount }}
+                (<span style="color: {{ pr.status_color }};">{{ pr.status }}</span>, {{ pr.doc_status }})
+            </li>
+        {% endfor %}
+        </ul>
+    </div>
+</div>
+"""
 
 
 def validate_po_payment_limit(doc, method=None):
@@ -28,95 +95,58 @@ def validate_po_payment_limit(doc, method=None):
         return
     
     try:
-        # Get Purchase Order
-        po = frappe.get_doc("Purchase Order", doc.reference_name)
+        # Get Purchase Order total (cached, no full doc load)
+        po_total = get_po_grand_total(doc.reference_name)
+        if po_total is None:
+            raise frappe.DoesNotExistError
         
-        # Get all Payment Requests for this PO (including current one)
-        existing_prs = frappe.get_all(
-            "Payment Request",
-            filters={
-                "reference_doctype": "Purchase Order",
-                "reference_name": doc.reference_name,
-                "docstatus": ["!=", 2],  # Not cancelled
-                "name": ["!=", doc.name]  # Exclude current PR
-            },
-            fields=["name", "grand_total", "custom_reconciliation_status", "docstatus"]
+        # Total of other non-cancelled Payment Requests for this PO
+        total_existing_payments = sum(
+            amount for pr_name, amount in get_po_payment_requests(doc.reference_name).items()
+            if pr_name != doc.name
         )
         
         # Calculate total payments
-        total_existing_payments = sum([pr.grand_total for pr in existing_prs])
         current_payment = doc.grand_total or 0
         total_payments = total_existing_payments + current_payment
         
         # Get PO total
-        po_total = po.grand_total or 0
+        po_total = po_total or 0
         
         # Check if exceeds
         if total_payments > po_total:
             excess_amount = total_payments - po_total
             
-            error_html = f"""
-            <div style="padding: 15px;">
-                <h4 style="color: red;">❌ Payment Exceeds Purchase Order Total</h4>
-                
-                <table class="table table-bordered" style="margin-top: 15px;">
-                    <tr>
-                        <th style="width: 50%;">Purchase Order Total</th>
-                        <td><b>₹{po_total:,.2f}</b></td>
-                    </tr>
-                    <tr>
-                        <th>Existing Payments</th>
-                        <td>₹{total_existing_payments:,.2f}</td>
-                    </tr>
-                    <tr>
-                        <th>Current Payment</th>
-                        <td>₹{current_payment:,.2f}</td>
-                    </tr>
-                    <tr style="background-color: #f8d7da;">
-                        <th>Total Payments</th>
-                        <td><b>₹{total_payments:,.2f}</b></td>
-                    </tr>
-                    <tr style="background-color: #f8d7da;">
-                        <th>Excess Amount</th>
-                        <td style="color: red;"><b>₹{excess_amount:,.2f}</b></td>
-                    </tr>
-                </table>
-                
-                <div style="margin-top: 20px; padding: 15px; background-color: #fff3cd; border-left: 4px solid #ffc107;">
-                    <h5>Options to Proceed:</h5>
-                    <ol>
-                        <li><b>Reduce Payment Amount</b> to ₹{po_total - total_existing_payments:,.2f} or less</li>
-                        <li><b>Enable Director Override</b> if this excess payment is authorized</li>
-                        <li><b>Cancel/Modify</b> existing Payment Requests</li>
-                    </ol>
-                </div>
-                
-                <div style="margin-top: 15px; padding: 10px; background-color: #d1ecf1; border-left: 4px solid #0c5460;">
-                    <b>ℹ️ Existing Payment Requests ({len(existing_prs)}):</b><br>
-                    <ul style="margin-top: 10px;">
-            """
-            
-            for pr in existing_prs:
-                status_color = {
-                    "Success": "green",
-                    "Pending": "orange",
-                    "Failed": "red"
-                }.get(pr.custom_reconciliation_status, "gray")
-                
-                doc_status = {0: "Draft", 1: "Submitted", 2: "Cancelled"}.get(pr.docstatus, "Unknown")
-                
-                error_html += f"""
-                        <li>
-                            <b>{pr.name}</b>: ₹{pr.grand_total:,.2f} 
-                            (<span style="color: {status_color};">{pr.custom_reconciliation_status or 'Pending'}</span>, {doc_status})
-                        </li>
-                """
+            # Existing Payment Requests are only listed in the error message
+            existing_prs = frappe.get_all(
+                "Payment Request",
+                filters={
+                    "reference_doctype": "Purchase Order",
+                    "reference_name": doc.reference_name,
+                    "docstatus": ["!=", 2],  # Not cancelled
+                    "name": ["!=", doc.name]  # Exclude current PR
+                },
+                fields=["name", "grand_total", "custom_reconciliation_status", "docstatus"]
+            )
             
-            error_html += """
-                    </ul>
-                </div>
-            </div>
-            """
+            error_html = frappe.render_template(PO_EXCEEDS_TEMPLATE, {
+                "po_total": f"{po_total:,.2f}",
+                "existing_total": f"{total_existing_payments:,.2f}",
+                "current_payment": f"{current_payment:,.2f}",
+                "total_payments": f"{total_payments:,.2f}",
+                "excess_amount": f"{excess_amount:,.2f}",
+                "allowed_amount": f"{po_total - total_existing_payments:,.2f}",
+                "existing_prs": [
+                    {
+                        "name": pr.name,
+                        "amount": f"{pr.grand_total:,.2f}",
+                        "status": pr.custom_reconciliation_status or "Pending",
+                        "status_color": STATUS_COLORS.get(pr.custom_reconciliation_status, "gray"),
+                        "doc_status": {0: "Draft", 1: "Submitted", 2: "Cancelled"}.get(pr.docstatus, "Unknown")
+                    }
+                    for pr in existing_prs
+                ]
+            })
             
             frappe.throw(error_html, title=_("Payment Limit Exceeded"))
     
@@ -128,6 +158,57 @@ def validate_po_payment_limit(doc, method=None):
         pass
 
 
+def get_po_grand_total(purchase_order):
+    """Purchase Order grand_total from redis, falling back to the DB (None if the PO doesn't exist)"""
+    po_total = frappe.cache().hget(PO_GRAND_TOTAL_KEY, purchase_order)
+    if po_total is None:
+        po_total = frappe.db.get_value("Purchase Order", purchase_order, "grand_total")
+        if po_total is not None:
+            frappe.cache().hset(PO_GRAND_TOTAL_KEY, purchase_order, po_total)
+    
+    return po_total
+
+
+def get_po_payment_requests(purchase_order):
+    """{payment_request: grand_total} of non-cancelled Payment Requests against a PO, cached in redis"""
+    totals = frappe.cache().hget(PO_PAYMENT_REQUESTS_KEY, purchase_order)
+    if totals is None:
+        totals = dict(frappe.db.sql("""
+            SELECT name, COALESCE(grand_total, 0)
+            FROM `tabPayment Request`
+            WHERE reference_doctype = 'Purchase Order'
+                AND reference_name = %s
+                AND docstatus != 2
+        """, (purchase_order,)))
+        frappe.cache().hset(PO_PAYMENT_REQUESTS_KEY, purchase_order, totals)
+    
+    return totals
+
+
+def clear_po_grand_total(doc, method=None):
+    """Purchase Order hooks: drop the cached grand_total"""
+    _clear_cached(PO_GRAND_TOTAL_KEY, doc.name)
+
+
+def clear_po_payment_requests(doc, method=None):
+    """Payment Request hooks: drop the cached Payment Request totals of its PO"""
+    # Include the previous PO in case the reference was changed on this save
+    before = doc.get_doc_before_save()
+    
+    for ref in (doc, before):
+        if ref and ref.reference_doctype == "Purchase Order" and ref.reference_name:
+            _clear_cached(PO_PAYMENT_REQUESTS_KEY, ref.reference_name)
+
+
+def _clear_cached(key, name):
+    """
+    Drop a cached hash entry now and again once the transaction commits, so a
+    reader that re-cached pre-commit values in between doesn't keep them
+    """
+    frappe.cache().hdel(key, name)
+    frappe.db.after_commit.add(lambda: frappe.cache().hdel(key, name))
+
+
 def validate_reference_document(doc, method=None):
     """
     Validate that reference document exists and is valid
@@ -138,8 +219,18 @@ def validate_reference_document(doc, method=None):
     if not doc.reference_doctype or not doc.reference_name:
         return
     
+    # Purchase Orders: existence check and the fields validated below in one query
+    if doc.reference_doctype == "Purchase Order":
+        po = frappe.db.get_value(
+            "Purchase Order", doc.reference_name, ["docstatus", "supplier"], as_dict=True
+        )
+        exists = bool(po)
+    else:
+        po = None
+        exists = frappe.db.exists(doc.reference_doctype, doc.reference_name)
+    
     # Check if reference document exists
-    if not frappe.db.exists(doc.reference_doctype, doc.reference_name):
+    if not exists:
         frappe.throw(
             f"❌ <b>Invalid Reference Document</b><br><br>"
             f"{doc.reference_doctype} <b>{doc.reference_name}</b> does not exist.<br><br>"
@@ -148,9 +239,7 @@ def validate_reference_document(doc, method=None):
         )
     
     # Additional validation for Purchase Orders
-    if doc.reference_doctype == "Purchase Order":
-        po = frappe.get_doc("Purchase Order", doc.reference_name)
-        
+    if po:
         # Check if PO is submitted
         if po.docstatus != 1:
             frappe.throw(
@@ -200,7 +289,7 @@ def validate_bank_account_required(doc, method=None):
         )
     
     # Check if bank account is verified
-    bank = frappe.get_doc("Bank Account", doc.bank_account)
+    bank = get_bank_verification_status(doc.bank_account)
     
     verification_status = bank.get("custom_bank_account_approval_status")
     is_verified = bank.get("custom_bank_account_verified")
@@ -220,51 +309,77 @@ def validate_bank_account_required(doc, method=None):
         )
 
 
+def get_bank_verification_status(bank_account):
+    """
+    Approval status + verified flag for a Bank Account, cached in redis
+    Cleared by the Bank Account on_update hook (and after bulk verification).
+    """
+    status = frappe.cache().hget(BANK_VERIFY_STATUS_KEY, bank_account)
+    if status is None:
+        status = frappe.db.get_value(
+            "Bank Account",
+            bank_account,
+            ["custom_bank_account_approval_status", "custom_bank_account_verified"],
+            as_dict=True
+        ) or {}
+        frappe.cache().hset(BANK_VERIFY_STATUS_KEY, bank_account, status)
+    
+    return status
+
+
+def clear_bank_verification_status(doc, method=None):
+    """Bank Account on_update: drop the cached verification status"""
+    frappe.cache().hdel(BANK_VERIFY_STATUS_KEY, doc.name)
+
+
 @frappe.whitelist()
-def check_po_payment_status(purchase_order):
+def check_po_payment_status(purchase_order, include_details=True):
     """
     Check payment status for a Purchase Order
     Returns total paid, remaining amount, and list of payment requests
     
     Args:
         purchase_order: Name of Purchase Order
+        include_details: Also return the individual Payment Requests
     
     Returns:
         dict: Payment status details
     """
     
     try:
-        po = frappe.get_doc("Purchase Order", purchase_order)
+        po_total = frappe.db.get_value("Purchase Order", purchase_order, "grand_total")
+        if po_total is None:
+            frappe.throw(f"Purchase Order {purchase_order} not found")
         
-        # Get all Payment Requests
-        payment_requests = frappe.get_all(
-            "Payment Request",
-            filters={
-                "reference_doctype": "Purchase Order",
-                "reference_name": purchase_order,
-                "docstatus": ["!=", 2]
-            },
-            fields=[
-                "name",
-                "grand_total",
-                "custom_reconciliation_status",
-                "custom_cashfree_payout_id",
-                "docstatus",
-                "creation",
-                "workflow_state"
-            ],
-            order_by="creation desc"
-        )
+        # Totals per reconciliation status in one query
+        buckets = frappe.db.sql("""
+            SELECT custom_reconciliation_status AS status, SUM(grand_total) AS total, COUNT(*) AS count
+            FROM `tabPayment Request`
+            WHERE reference_doctype = 'Purchase Order'
+                AND reference_name = %s
+                AND docstatus != 2
+            GROUP BY custom_reconciliation_status
+        """, (purchase_order,), as_dict=True)
         
         # Calculate totals
-        total_paid = sum([pr.grand_total for pr in payment_requests if pr.custom_reconciliation_status == "Success"])
-        total_pending = sum([pr.grand_total for pr in payment_requests if pr.custom_reconciliation_status in ["Pending", "Queued"]])
-        total_failed = sum([pr.grand_total for pr in payment_requests if pr.custom_reconciliation_status == "Failed"])
+        total_paid = 0
+        total_pending = 0
+        total_failed = 0
+        payment_count = 0
         
-        po_total = po.grand_total or 0
+        for bucket in buckets:
+            payment_count += bucket.count
+            if bucket.status == "Success":
+                total_paid += bucket.total or 0
+            elif bucket.status in ["Pending", "Queued"]:
+                total_pending += bucket.total or 0
+            elif bucket.status == "Failed":
+                total_failed += bucket.total or 0
+        
+        po_total = po_total or 0
         remaining = po_total - total_paid - total_pending
         
-        return {
+        result = {
             "success": True,
             "po_name": purchase_order,
             "po_total": po_total,
@@ -272,10 +387,32 @@ def check_po_payment_status(purchase_order):
             "total_pending": total_pending,
             "total_failed": total_failed,
             "remaining": remaining,
-            "payment_requests": payment_requests,
-            "payment_count": len(payment_requests)
+            "payment_count": payment_count
         }
         
+        if cint(include_details):
+            # Get all Payment Requests
+            result["payment_requests"] = frappe.get_all(
+                "Payment Request",
+                filters={
+                    "reference_doctype": "Purchase Order",
+                    "reference_name": purchase_order,
+                    "docstatus": ["!=", 2]
+                },
+                fields=[
+                    "name",
+                    "grand_total",
+                    "custom_reconciliation_status",
+                    "custom_cashfree_payout_id",
+                    "docstatus",
+                    "creation",
+                    "workflow_state"
+                ],
+                order_by="creation desc"
+            )
+        
+        return result
+        
     except Exception as e:
         return {
             "success": False,
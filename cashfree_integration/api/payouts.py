@@ -4,19 +4,195 @@
 
 
 import frappe
+import logging
+import re
 import traceback
 import time
 from frappe.utils import now
+from frappe.model.naming import make_autoname
 from cashfree_integration.api_manager import CashfreeAPIManager
+from cashfree_integration.api.bav import get_settings_version
+from cashfree_integration.api.payment_validation import get_po_grand_total
 
 
-def log_message(data, title="Cashfree Payout Log"):
-    """Helper to log messages to Error Log"""
+# Redis hash of beneficiary display names, keyed by "party_type::party"
+PARTY_NAME_KEY = "cashfree_party_name"
+
+# Display-name field per party type (anything else falls back to its name)
+PARTY_NAME_FIELDS = {"Supplier": "supplier_name", "Customer": "customer_name"}
+
+# CashfreeAPIManager reused across payouts, per site: {site: {"mgr", "version", "expires"}}
+_cf_manager_cache = {}
+
+# Cashfree responses meaning the credentials were rejected (only these drop the cached manager)
+AUTH_FAILURE_STATUS_CODES = frozenset({401, 403})
+
+# Seconds a confirmed beneficiary is trusted without another get_beneficiary call
+BENE_VERIFIED_TTL = 3600
+
+# Anything that isn't a digit, stripped from beneficiary phone numbers
+_NON_DIGIT = re.compile(r"\D")
+
+# Beneficiary ID sanitising: spaces/hyphens -> "_", drop other non-word chars, squeeze "_" runs
+_BENE_SEPARATORS = str.maketrans(" -", "__")
+_BENE_INVALID_CHARS = re.compile(r"[^\w]+")
+_UNDERSCORE_RUN = re.compile(r"_{2,}")
+
+# Bank Account fields read by the payout flow (loaded as a row, not a full doc)
+PAYOUT_BANK_FIELDS = (
+    "name", "party", "party_type", "bank_account_no", "account_name",
+    "custom_ifsc_code", "branch_code", "custom_cashfree_beneficiary_id",
+    "custom_bank_account_approval_status", "custom_bank_account_verified",
+    "custom_verified_by"
+)
+
+# Shown when a payout is blocked on an unverified Bank Account
+BANK_UNVERIFIED_TEMPLATE = (
+    "⚠️ <b>Bank Account Not Verified</b><br><br>"
+    "<div style='background: #fff3cd; padding: 10px; border-left: 4px solid #ffc107;'>"
+    "<b>Bank Account:</b> {bank}<br>"
+    "<b>Account Number:</b> {account_no}<br>"
+    "<b>Current Status:</b> {approval_status}<br>"
+    "<b>Verified:</b> {verified}<br>"
+    "<b>Last Checked By:</b> {verified_by}<br>"
+    "</div><br>"
+    "<b>⚡ Action Required:</b><br>"
+    "<ol>"
+    "<li>Open Bank Account: <a href='/app/bank-account/{bank}' target='_blank'><b>{bank}</b></a></li>"
+    "<li>Click <b>'Verify Bank Account'</b> button</li>"
+    "<li>Wait for verification (5-10 seconds)</li>"
+    "<li>Return here and retry</li>"
+    "</ol>"
+)
+
+# Shown when a payout exceeds its Purchase Order without Director Override
+OVER_PO_TEMPLATE = (
+    "🔒 <b>Over-PO Payment Blocked</b><br><br>"
+    "<div style='background: #fff3cd; padding: 15px; border-left: 4px solid #ff9800;'>"
+    "<b>Purchase Order:</b> {purchase_order}<br>"
+    "<b>PO Amount:</b> ₹{po_amount:,.2f}<br>"
+    "<b>Payment Amount:</b> ₹{payment_amount:,.2f}<br>"
+    "<b>⚠️ Over Amount:</b> <span style='color: #d32f2f; font-weight: bold;'>₹{over_amount:,.2f}</span>"
+    "</div><br>"
+    "<div style='background: #f8d7da; padding: 15px; border-left: 4px solid #dc3545;'>"
+    "<b>🔒 Director Override Required</b><br><br>"
+    "<b>To proceed:</b><br>"
+    "<ol>"
+    "<li>Get approval from Director</li>"
+    "<li>Enable <b>'Director Override'</b> checkbox</li>"
+    "<li>Save document</li>"
+    "<li>Retry payout</li>"
+    "</ol>"
+    "</div>"
+)
+
+# Workflow states (lower-cased) that trigger a payout
+PAYOUT_TRIGGER_STATES = frozenset({"queued", "queue for payout", "queued for payout"})
+
+# Cashfree transfer status -> reconciliation status
+PAYOUT_STATUS_MAP = {
+    "RECEIVED": "Pending",
+    "SUCCESS": "Success",
+    "PENDING": "Pending",
+    "QUEUED": "Pending",
+    "FAILED": "Failed",
+    "ERROR": "Failed",
+    "REVERSED": "Reversed",
+    "REJECTED": "Failed",
+}
+
+
+def log_message(data, title="Cashfree Payout Log", level="error", exc_info=False):
+    """
+    Helper to log messages to Error Log
+    level="info" entries are dropped (and never serialized) when the logger is above INFO,
+    otherwise queued through deferred insert so they stay off the payout's transaction.
+    exc_info=True attaches the full traceback to error entries; info entries only get it
+    when verbose_cashfree_logs is set in site config.
+    """
+    if level == "info" and not frappe.logger().isEnabledFor(logging.INFO):
+        return
+    
+    if exc_info and (level != "info" or frappe.conf.get("verbose_cashfree_logs")):
+        data = dict(data, traceback=frappe.get_traceback())
+    
     try:
         text = frappe.as_json(data)
     except Exception:
         text = str(data)
-    frappe.log_error(text, title)
+    frappe.log_error(text, title, defer_insert=(level == "info"))
+
+
+def _is_interactive():
+    """True when running for a web request, where alerts and HTML messages reach a user"""
+    return getattr(frappe.local, "request", None) is not None
+
+
+def _get_cf_manager(ttl=300):
+    """
+    Return a CashfreeAPIManager for the current site
+    Reused for `ttl` seconds so a burst of payouts doesn't reload and decrypt
+    Cashfree Settings every time. The shared settings version (bav.SETTINGS_VERSION_KEY)
+    is checked on every call, so a settings change (disabling payouts, rotated keys)
+    reaches all workers immediately rather than when their copy expires.
+    """
+    version = get_settings_version()
+    entry = _cf_manager_cache.get(frappe.local.site)
+    if entry and entry["version"] == version and time.monotonic() < entry["expires"]:
+        return entry["mgr"]
+    
+    mgr = CashfreeAPIManager()
+    _cf_manager_cache[frappe.local.site] = {
+        "mgr": mgr, "version": version, "expires": time.monotonic() + ttl
+    }
+    
+    return mgr
+
+
+def clear_cf_manager_cache():
+    """
+    Drop this worker's cached CashfreeAPIManager for the current site
+    Settings saves reach every worker through the shared version (bav.clear_settings_cache).
+    """
+    _cf_manager_cache.pop(frappe.local.site, None)
+
+
+def _is_auth_failure(exc):
+    """True if `exc`, or the HTTPError it was raised from, is a Cashfree 401/403"""
+    while exc is not None:
+        response = getattr(exc, "response", None)
+        if response is not None and response.status_code in AUTH_FAILURE_STATUS_CODES:
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def _is_bene_verified(bene_id):
+    """True if any worker confirmed the beneficiary in Cashfree within BENE_VERIFIED_TTL"""
+    return bool(frappe.cache().get_value(f"cashfree:bene_verified:{bene_id}"))
+
+
+def _mark_bene_verified(bene_id):
+    frappe.cache().set_value(f"cashfree:bene_verified:{bene_id}", 1, expires_in_sec=BENE_VERIFIED_TTL)
+
+
+def _forget_bene_verified(bene_id):
+    frappe.cache().delete_value(f"cashfree:bene_verified:{bene_id}")
+
+
+def beneficiary_exists(cf_manager, bene_id):
+    """
+    check_beneficiary_exists, with positive answers shared across workers for BENE_VERIFIED_TTL
+    Repeat checks for the same vendor in a batch cost one Cashfree call.
+    """
+    if _is_bene_verified(bene_id):
+        return True
+    
+    if cf_manager.check_beneficiary_exists(bene_id):
+        _mark_bene_verified(bene_id)
+        return True
+    
+    return False
 
 
 def get_contact_details_from_bank(bank):
@@ -25,23 +201,22 @@ def get_contact_details_from_bank(bank):
     phone = ""
     
     try:
-        contacts = frappe.get_all(
-            "Dynamic Link",
-            filters={
-                "link_doctype": "Bank Account",
-                "link_name": bank.name,
-                "parenttype": "Contact"
-            },
-            fields=["parent"]
-        )
+        # Contact email + first phone in one query (no full Contact load)
+        row = frappe.db.sql("""
+            SELECT c.email_id, p.phone
+            FROM `tabDynamic Link` dl
+            JOIN `tabContact` c ON c.name = dl.parent
+            LEFT JOIN `tabContact Phone` p
+                ON p.parent = c.name AND p.parenttype = 'Contact' AND p.idx = 1
+            WHERE dl.parenttype = 'Contact'
+                AND dl.link_doctype = 'Bank Account'
+                AND dl.link_name = %s
+            LIMIT 1
+        """, bank.name, as_dict=True)
         
-        if contacts:
-            contact_name = contacts[0].parent
-            contact = frappe.get_doc("Contact", contact_name)
-            email = contact.email_id or ""
-            phone_nos = contact.get('phone_nos', [])
-            if phone_nos:
-                phone = phone_nos[0].phone or ""
+        if row:
+            email = row[0].email_id or ""
+            phone = row[0].phone or ""
                 
     except Exception as e:
         log_message(
@@ -50,7 +225,7 @@ def get_contact_details_from_bank(bank):
         )
     
     # Clean phone number
-    phone = ''.join(filter(str.isdigit, phone))
+    phone = _NON_DIGIT.sub("", phone)
     
     return email, phone
 
@@ -59,38 +234,43 @@ def get_party_name_from_bank(bank):
     """Get party name for beneficiary"""
     if bank.party:
         try:
-            party_doc = frappe.get_doc(bank.party_type, bank.party)
-            if hasattr(party_doc, 'supplier_name'):
-                return party_doc.supplier_name
-            elif hasattr(party_doc, 'customer_name'):
-                return party_doc.customer_name
-            else:
-                return party_doc.name
+            name = get_party_display_name(bank.party_type, bank.party)
+            if name:
+                return name
         except Exception as e:
             frappe.logger().warning(f"Could not fetch party name: {str(e)}")
     
     return bank.account_name or bank.party or ""
 
 
-def generate_beneficiary_id(bank):
+def get_party_display_name(party_type, party):
+    """Supplier/Customer display name, cached in redis until the party is updated"""
+    key = f"{party_type}::{party}"
+    name = frappe.cache().hget(PARTY_NAME_KEY, key)
+    if name is None:
+        name = frappe.db.get_value(party_type, party, PARTY_NAME_FIELDS.get(party_type, "name"))
+        if name:
+            frappe.cache().hset(PARTY_NAME_KEY, key, name)
+    
+    return name
+
+
+def clear_party_display_name(doc, method=None):
+    """Supplier/Customer hooks: drop the cached display name"""
+    frappe.cache().hdel(PARTY_NAME_KEY, f"{doc.doctype}::{doc.name}")
+
+
+def generate_beneficiary_id(bank, party_name=None):
     """
     Generate consistent beneficiary_id (max 50 chars)
     Format: BENE_PartyName_AcctLast4
     """
-    party_name = get_party_name_from_bank(bank)
+    if party_name is None:
+        party_name = get_party_name_from_bank(bank)
     
-    # Clean party name
-    party_clean = party_name.replace(" ", "_").replace("-", "_")
-    party_clean = "".join(c for c in party_clean if c.isalnum() or c == "_")
-    
-    while "__" in party_clean:
-        party_clean = party_clean.replace("__", "_")
-    
-    party_clean = party_clean.strip("_")
-    party_clean = party_clean[:30]  # Limit to 30 chars
-    
-    if not party_clean:
-        party_clean = "UNKNOWN"
+    # Clean party name (limit to 30 chars)
+    party_clean = _BENE_INVALID_CHARS.sub("", party_name.translate(_BENE_SEPARATORS))
+    party_clean = _UNDERSCORE_RUN.sub("_", party_clean).strip("_")[:30] or "UNKNOWN"
     
     # Get last 4 digits of account
     account_suffix = bank.bank_account_no[-4:] if bank.bank_account_no else "0000"
@@ -105,33 +285,34 @@ def create_or_get_beneficiary(bank, cf_manager):
     """
     Create or get existing beneficiary using API Manager
     Handles conflicts gracefully
-    """
-    # Generate beneficiary ID
-    bene_id = generate_beneficiary_id(bank)
     
-    # Check if already stored in Bank Account
-    existing_bene = bank.get("custom_cashfree_beneficiary_id")
+    Returns:
+        tuple: (bene_id, was_existing) - was_existing is True when the stored
+        beneficiary was confirmed in Cashfree
+    """
+    # Check if already stored in Bank Account (before any party/ID work)
+    existing_bene = bank.custom_cashfree_beneficiary_id
     if existing_bene:
         frappe.logger().info(f"Using existing beneficiary: {existing_bene}")
         
-        # Verify it exists in Cashfree
-        try:
-            verify_response = cf_manager.get_beneficiary(existing_bene)
-            if verify_response.get("data"):
-                return existing_bene
-        except:
-            frappe.logger().warning(f"Stored beneficiary {existing_bene} not found in Cashfree, creating new")
+        # Verify it exists in Cashfree (skipped if confirmed recently)
+        if beneficiary_exists(cf_manager, existing_bene):
+            return existing_bene, True
+        
+        frappe.logger().warning(f"Stored beneficiary {existing_bene} not found in Cashfree, creating new")
+    
+    # Generate beneficiary ID
+    party_name = get_party_name_from_bank(bank)
+    bene_id = generate_beneficiary_id(bank, party_name=party_name)
     
     # Get contact details
     email, phone = get_contact_details_from_bank(bank)
     
     # Get IFSC
-    ifsc = bank.get("custom_ifsc_code") or bank.get("branch_code") or ""
+    ifsc = bank.custom_ifsc_code or bank.branch_code or ""
     if not ifsc:
         raise Exception("IFSC code missing in Bank Account")
     
-    party_name = get_party_name_from_bank(bank)
-    
     # Create beneficiary using API Manager
     try:
         frappe.logger().info(f"Creating beneficiary: {bene_id} for {party_name}")
@@ -151,10 +332,11 @@ def create_or_get_beneficiary(bank, cf_manager):
         
         log_message(
             {"result": result, "bene_id": bene_id},
-            "Cashfree Beneficiary Created/Retrieved"
+            "Cashfree Beneficiary Created/Retrieved",
+            level="info"
         )
         
-        # Store beneficiary ID in Bank Account
+        # Store beneficiary ID in Bank Account (committed with the payout link)
         frappe.db.set_value(
             "Bank Account", 
             bank.name, 
@@ -162,30 +344,55 @@ def create_or_get_beneficiary(bank, cf_manager):
             bene_id, 
             update_modified=False
         )
-        frappe.db.commit()
         
         frappe.logger().info(f"✅ Beneficiary ready: {bene_id}")
         
-        return bene_id
+        return bene_id, False
         
     except Exception as e:
         error_msg = str(e)
+        _forget_bene_verified(bene_id)
         
         log_message(
-            {"error": error_msg, "bene_id": bene_id, "bank": bank.name, "traceback": traceback.format_exc()},
-            "Cashfree Beneficiary Error"
+            {"error": error_msg, "bene_id": bene_id, "bank": bank.name, "exc": "".join(traceback.format_exception_only(type(e), e))},
+            "Cashfree Beneficiary Error",
+            exc_info=True
         )
         
         raise Exception(f"Beneficiary creation failed: {error_msg}")
 
 
+def _wait_beneficiary_ready(cf_manager, bene_id, was_existing, max_wait=2.0):
+    """
+    Wait until a newly created beneficiary can be fetched from Cashfree
+    Polls with backoff up to max_wait seconds; returns at once for a verified existing one.
+    """
+    if was_existing:
+        return
+    
+    delay = 0.1
+    deadline = time.monotonic() + max_wait
+    while True:
+        # Lightweight existence check (short timeout, never raises)
+        if beneficiary_exists(cf_manager, bene_id):
+            return
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            frappe.logger().warning(f"Beneficiary {bene_id} not confirmed after {max_wait}s, continuing")
+            return
+        
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.5)
+
+
 def initiate_payout(doc, amount, bene_id, cf_manager, settings):
     """
     Initiate payout using API Manager
     """
     try:
         # Get remarks
-        remarks = f"{getattr(settings, 'payout_remarks_prefix', 'TK')} {doc.name}"
+        remarks = f"{cf_manager.payout_remarks_prefix} {doc.name}"
         
         # Create transfer using API Manager
         frappe.logger().info(f"Initiating transfer: {doc.name} to {bene_id} for ₹{amount}")
@@ -199,7 +406,8 @@ def initiate_payout(doc, amount, bene_id, cf_manager, settings):
         
         log_message(
             {"pr": doc.name, "response": result},
-            "Cashfree Transfer Success"
+            "Cashfree Transfer Success",
+            level="info"
         )
         
         # Extract data from response (V2 API format)
@@ -210,29 +418,23 @@ def initiate_payout(doc, amount, bene_id, cf_manager, settings):
         raw_status = transfer_details.get("transfer_status") or data.get("status") or "PENDING"
         
         # Map status
-        status_mapping = {
-            "RECEIVED": "Pending",
-            "SUCCESS": "Success",
-            "PENDING": "Pending",
-            "QUEUED": "Pending",
-            "FAILED": "Failed",
-            "ERROR": "Failed",
-            "REVERSED": "Reversed",
-            "REJECTED": "Failed",
-        }
-        status = status_mapping.get(str(raw_status).upper(), "Pending")
+        if not isinstance(raw_status, str):
+            raw_status = str(raw_status)
+        status = PAYOUT_STATUS_MAP.get(raw_status.upper(), "Pending")
         
         frappe.logger().info(f"✅ Transfer initiated: {payout_id} - Status: {status}")
         
         # ========================================
-        # ADD THESE 3 LINES (CRITICAL FOR WEBHOOK!)
+        # CRITICAL FOR WEBHOOK - committed by the caller
+        # together with the beneficiary ID and payout log.
+        # Also clears the UTR of a failed payout being retried.
         # ========================================
         frappe.db.set_value("Payment Request", doc.name, {
             "custom_cashfree_payout_id": payout_id,      # Links webhook!
+            "custom_utr_number": None,
             "custom_reconciliation_status": status       # Pending/Success
         }, update_modified=False)
         
-        frappe.db.commit()  # Ensure webhook sees it immediately
         frappe.logger().info(f"🔗 PR Linked: {doc.name} ↔ {payout_id}")
         # ========================================
         
@@ -240,13 +442,39 @@ def initiate_payout(doc, amount, bene_id, cf_manager, settings):
         
     except Exception as e:
         log_message(
-            {"exception": str(e), "traceback": traceback.format_exc(), "pr": doc.name, "bene_id": bene_id},
-            "Cashfree Transfer Error"
+            {"exception": str(e), "exc": "".join(traceback.format_exception_only(type(e), e)), "pr": doc.name, "bene_id": bene_id},
+            "Cashfree Transfer Error",
+            exc_info=True
         )
         raise
 
 
 
+def _write_payout_log(pr_name, payout_id, transfer_mode, amount, status, bene_id, response_data):
+    """
+    Background job: record a payout in Cashfree Payout Log
+    Append-only row, so it is inserted directly rather than through the Document lifecycle;
+    the name is taken from the CF-LOG- series so it matches the DocType's autoname.
+    """
+    timestamp = now()
+    user = frappe.session.user
+    
+    frappe.db.bulk_insert(
+        "Cashfree Payout Log",
+        fields=[
+            "name", "creation", "modified", "owner", "modified_by",
+            "payment_request", "payout_id", "transfer_mode", "amount", "status",
+            "request_payload", "response_payload"
+        ],
+        values=[(
+            make_autoname("CF-LOG-.#####", "Cashfree Payout Log"), timestamp, timestamp, user, user,
+            pr_name, payout_id, transfer_mode, amount, status,
+            frappe.as_json({"bene_id": bene_id, "amount": amount}),
+            frappe.as_json(response_data)
+        )]
+    )
+
+
 def trigger_payout_for_payment_request(doc, method=None):
     """
     Triggered when Payment Request updates
@@ -255,48 +483,57 @@ def trigger_payout_for_payment_request(doc, method=None):
     
     log_message(
         {"pr": doc.name, "workflow_state": doc.workflow_state, "method": method},
-        "Cashfree Trigger Start V3"
+        "Cashfree Trigger Start V3",
+        level="info"
     )
     
     state = (doc.workflow_state or "").strip().lower()
-    if state not in ["queued", "queue for payout", "queued for payout"]:
+    if state not in PAYOUT_TRIGGER_STATES:
         return
     
+    # Read the stored payout fields without a row lock: the lock would be held across
+    # the Cashfree calls below and block the webhook. A concurrent duplicate trigger is
+    # rejected by Cashfree, since the transfer ID is the Payment Request name.
+    stored = frappe.db.get_value(
+        "Payment Request",
+        doc.name,
+        ["custom_cashfree_payout_id", "custom_reconciliation_status"],
+        as_dict=True
+    ) or doc
+    
     # RETRY SUPPORT
-    existing_payout = doc.get("custom_cashfree_payout_id")
-    recon_status = (doc.get("custom_reconciliation_status") or "").upper()
+    existing_payout = stored.get("custom_cashfree_payout_id")
+    recon_status = (stored.get("custom_reconciliation_status") or "").upper()
     
     if existing_payout:
         if recon_status in ["FAILED", "REVERSED", "REJECTED"]:
+            # The old payout ID and UTR are replaced by the new payout link below
             frappe.logger().info(
-                f"🔄 Retry detected for {doc.name}: Clearing old payout {existing_payout}"
+                f"🔄 Retry detected for {doc.name}: Replacing old payout {existing_payout}"
             )
             
-            frappe.db.set_value("Payment Request", doc.name, "custom_cashfree_payout_id", None, update_modified=False)
-            frappe.db.set_value("Payment Request", doc.name, "custom_utr_number", None, update_modified=False)
-            frappe.db.set_value("Payment Request", doc.name, "custom_reconciliation_status", "Pending", update_modified=False)
-            frappe.db.commit()
-            
             log_message(
                 {"pr": doc.name, "action": "Retry payout", "old_payout_id": existing_payout},
                 "Cashfree Payout Retry"
             )
             
-            frappe.msgprint(
-                f"🔄 Retrying payout after failure<br>"
-                f"<b>Old Payout ID:</b> {existing_payout}<br>"
-                f"<b>Previous Status:</b> {recon_status}",
-                alert=True,
-                indicator="blue"
-            )
+            if _is_interactive():
+                frappe.msgprint(
+                    f"🔄 Retrying payout after failure<br>"
+                    f"<b>Old Payout ID:</b> {existing_payout}<br>"
+                    f"<b>Previous Status:</b> {recon_status}",
+                    alert=True,
+                    indicator="blue"
+                )
         else:
-            frappe.msgprint(
-                f"⚠️ Payout already exists<br>"
-                f"<b>Payout ID:</b> {existing_payout}<br>"
-                f"<b>Status:</b> {recon_status}",
-                alert=True,
-                indicator="orange"
-            )
+            if _is_interactive():
+                frappe.msgprint(
+                    f"⚠️ Payout already exists<br>"
+                    f"<b>Payout ID:</b> {existing_payout}<br>"
+                    f"<b>Status:</b> {recon_status}",
+                    alert=True,
+                    indicator="orange"
+                )
             return
     
     # Validate amount
@@ -314,39 +551,30 @@ def trigger_payout_for_payment_request(doc, method=None):
         log_message({"error": "No Bank Account", "pr": doc.name}, "Cashfree No Bank Account")
         frappe.throw("No Bank Account selected in Payment Request")
     
-    try:
-        bank = frappe.get_doc("Bank Account", doc.bank_account)
-    except Exception as e:
-        log_message({"error": "Bank fetch failed", "pr": doc.name, "exception": str(e)}, "Cashfree Bank Fetch Error")
-        frappe.throw(f"Bank account not found: {str(e)}")
+    bank = frappe.db.get_value("Bank Account", doc.bank_account, PAYOUT_BANK_FIELDS, as_dict=True)
+    if not bank:
+        log_message({"error": "Bank fetch failed", "pr": doc.name, "bank_account": doc.bank_account}, "Cashfree Bank Fetch Error")
+        frappe.throw(f"Bank account not found: {doc.bank_account}")
     
     # BANK VERIFICATION CHECK
-    approval_status = bank.get("custom_bank_account_approval_status")
-    verified = bank.get("custom_bank_account_verified")
+    bank_name, account_no, approval_status, verified = (
+        bank.name, bank.bank_account_no, bank.custom_bank_account_approval_status, bank.custom_bank_account_verified
+    )
     
     if approval_status != "Approved" or verified != 1:
-        verified_by = bank.get("custom_verified_by") or "Not verified"
-        
-        error_message = (
-            f"⚠️ <b>Bank Account Not Verified</b><br><br>"
-            f"<div style='background: #fff3cd; padding: 10px; border-left: 4px solid #ffc107;'>"
-            f"<b>Bank Account:</b> {bank.name}<br>"
-            f"<b>Account Number:</b> {bank.bank_account_no or 'N/A'}<br>"
-            f"<b>Current Status:</b> {approval_status or 'Not Verified'}<br>"
-            f"<b>Verified:</b> {'Yes ✓' if verified else 'No ✗'}<br>"
-            f"<b>Last Checked By:</b> {verified_by}<br>"
-            f"</div><br>"
-            f"<b>⚡ Action Required:</b><br>"
-            f"<ol>"
-            f"<li>Open Bank Account: <a href='/app/bank-account/{bank.name}' target='_blank'><b>{bank.name}</b></a></li>"
-            f"<li>Click <b>'Verify Bank Account'</b> button</li>"
-            f"<li>Wait for verification (5-10 seconds)</li>"
-            f"<li>Return here and retry</li>"
-            f"</ol>"
-        )
+        if _is_interactive():
+            error_message = BANK_UNVERIFIED_TEMPLATE.format(
+                bank=bank_name,
+                account_no=account_no or 'N/A',
+                approval_status=approval_status or 'Not Verified',
+                verified='Yes ✓' if verified else 'No ✗',
+                verified_by=bank.custom_verified_by or "Not verified"
+            )
+        else:
+            error_message = f"Bank Account Not Verified: {bank_name}"
         
         log_message(
-            {"pr": doc.name, "bank": bank.name, "error": "Unverified bank"},
+            {"pr": doc.name, "bank": bank_name, "error": "Unverified bank"},
             "Cashfree Payout Blocked - Unverified Bank"
         )
         
@@ -355,8 +583,7 @@ def trigger_payout_for_payment_request(doc, method=None):
     # DIRECTOR OVERRIDE CHECK
     if doc.reference_doctype == "Purchase Order" and doc.reference_name:
         try:
-            po = frappe.get_doc("Purchase Order", doc.reference_name)
-            po_amount = float(po.grand_total or 0)
+            po_amount = float(get_po_grand_total(doc.reference_name) or 0)
             payment_amount = float(doc.grand_total or 0)
             
             if payment_amount > po_amount:
@@ -364,25 +591,15 @@ def trigger_payout_for_payment_request(doc, method=None):
                 over_amount = payment_amount - po_amount
                 
                 if not director_override or director_override == 0:
-                    error_message = (
-                        f"🔒 <b>Over-PO Payment Blocked</b><br><br>"
-                        f"<div style='background: #fff3cd; padding: 15px; border-left: 4px solid #ff9800;'>"
-                        f"<b>Purchase Order:</b> {doc.reference_name}<br>"
-                        f"<b>PO Amount:</b> ₹{po_amount:,.2f}<br>"
-                        f"<b>Payment Amount:</b> ₹{payment_amount:,.2f}<br>"
-                        f"<b>⚠️ Over Amount:</b> <span style='color: #d32f2f; font-weight: bold;'>₹{over_amount:,.2f}</span>"
-                        f"</div><br>"
-                        f"<div style='background: #f8d7da; padding: 15px; border-left: 4px solid #dc3545;'>"
-                        f"<b>🔒 Director Override Required</b><br><br>"
-                        f"<b>To proceed:</b><br>"
-                        f"<ol>"
-                        f"<li>Get approval from Director</li>"
-                        f"<li>Enable <b>'Director Override'</b> checkbox</li>"
-                        f"<li>Save document</li>"
-                        f"<li>Retry payout</li>"
-                        f"</ol>"
-                        f"</div>"
-                    )
+                    if _is_interactive():
+                        error_message = OVER_PO_TEMPLATE.format(
+                            purchase_order=doc.reference_name,
+                            po_amount=po_amount,
+                            payment_amount=payment_amount,
+                            over_amount=over_amount
+                        )
+                    else:
+                        error_message = f"Director Override Required: payment exceeds {doc.reference_name} by ₹{over_amount:,.2f}"
                     
                     log_message(
                         {"pr": doc.name, "po": doc.reference_name, "po_amount": po_amount, 
@@ -404,19 +621,20 @@ def trigger_payout_for_payment_request(doc, method=None):
                         f"Director Override - {doc.name}"
                     )
                     
-                    frappe.msgprint(
-                        f"⚠️ <b>Director Override Active</b><br><br>"
-                        f"Over-PO payment approved by: <b>{frappe.session.user}</b><br>"
-                        f"Over Amount: ₹{over_amount:,.2f}",
-                        alert=True,
-                        indicator="orange"
-                    )
+                    if _is_interactive():
+                        frappe.msgprint(
+                            f"⚠️ <b>Director Override Active</b><br><br>"
+                            f"Over-PO payment approved by: <b>{frappe.session.user}</b><br>"
+                            f"Over Amount: ₹{over_amount:,.2f}",
+                            alert=True,
+                            indicator="orange"
+                        )
         except Exception as e:
             frappe.logger().error(f"Error checking PO: {str(e)}")
     
     # Initialize API Manager
     try:
-        cf_manager = CashfreeAPIManager()
+        cf_manager = _get_cf_manager()
         settings = cf_manager.settings
     except Exception as e:
         log_message({"error": "API Manager init failed", "pr": doc.name, "exception": str(e)}, "Cashfree Init Error")
@@ -424,44 +642,48 @@ def trigger_payout_for_payment_request(doc, method=None):
     
     # Create/get beneficiary
     try:
-        bene_id = create_or_get_beneficiary(bank, cf_manager)
+        bene_id, was_existing = create_or_get_beneficiary(bank, cf_manager)
         frappe.logger().info(f"✅ Beneficiary ready: {bene_id}")
     except Exception as e:
+        # Credentials rejected - rebuild this worker's manager next time
+        if _is_auth_failure(e):
+            clear_cf_manager_cache()
         log_message({"error": "Beneficiary failed", "pr": doc.name, "bank": bank.name, "exception": str(e)}, "Cashfree Beneficiary Failed")
         frappe.throw(f"Beneficiary creation failed: {str(e)}")
     
-    # Small delay to ensure beneficiary is ready
-    time.sleep(2)
+    # Make sure a new beneficiary is visible before transferring to it
+    _wait_beneficiary_ready(cf_manager, bene_id, was_existing)
     
     # Initiate payout
     try:
         payout_id, status, response_data = initiate_payout(doc, amount, bene_id, cf_manager, settings)
     except Exception as e:
+        if _is_auth_failure(e):
+            clear_cf_manager_cache()
+        _forget_bene_verified(bene_id)
         frappe.throw(f"Payout failed: {str(e)}")
     
-    # Create log
+    # Payout log is written by a short job once the payout commit lands
     try:
-        pl = frappe.get_doc({
-            "doctype": "Cashfree Payout Log",
-            "payment_request": doc.name,
-            "payout_id": payout_id or doc.name,
-            "transfer_mode": doc.get("custom_transfer_mode") or "NEFT",
-            "amount": amount,
-            "status": status,
-            "request_payload": frappe.as_json({"bene_id": bene_id, "amount": amount}),
-            "response_payload": frappe.as_json(response_data),
-        })
-        pl.insert(ignore_permissions=True)
+        frappe.enqueue(
+            "cashfree_integration.api.payouts._write_payout_log",
+            queue="short",
+            enqueue_after_commit=True,
+            pr_name=doc.name,
+            payout_id=payout_id or doc.name,
+            transfer_mode=doc.get("custom_transfer_mode") or "NEFT",
+            amount=amount,
+            status=status,
+            bene_id=bene_id,
+            response_data=response_data
+        )
     except Exception as e:
-        frappe.logger().error(f"Failed to create Payout Log: {str(e)}")
+        frappe.logger().error(f"Failed to queue Payout Log: {str(e)}")
     
-    # Update Payment Request
-    try:
-        if payout_id and payout_id != doc.name:
-            frappe.db.set_value("Payment Request", doc.name, "custom_cashfree_payout_id", payout_id, update_modified=False)
-        frappe.db.set_value("Payment Request", doc.name, "custom_reconciliation_status", status, update_modified=False)
-        frappe.db.commit()
-        
+    # One commit for the beneficiary ID and PR link, right after the transfer call
+    frappe.db.commit()
+    
+    if _is_interactive():
         frappe.msgprint(
             f"✅ <b>Payout Initiated</b><br><br>"
             f"<b>Payment Request:</b> {doc.name}<br>"
@@ -473,7 +695,5 @@ def trigger_payout_for_payment_request(doc, method=None):
             indicator='green',
             title='Payout Success'
         )
-        
-        log_message({"pr": doc.name, "payout_id": payout_id, "status": status, "bene_id": bene_id}, "Cashfree Payout Success")
-    except Exception as e:
-        log_message({"error": "PR update failed", "pr": doc.name, "exception": str(e)}, "Cashfree PR Update Error")
+    
+    log_message({"pr": doc.name, "payout_id": payout_id, "status": status, "bene_id": bene_id}, "Cashfree Payout Success", level="info")
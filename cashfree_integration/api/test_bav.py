@@ -0,0 +1,144 @@
+# Copyright (c) 2026, Frappe and Contributors
+# See license.txt
+
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from cashfree_integration.api import bav
+
+PAYLOAD = {"bank_account": "123456789012", "ifsc": "HDFC0001234", "name": "Test Party", "phone": "9999999999"}
+URL = "https://sandbox.cashfree.com/verification/bank-account/sync"
+HEADERS = {"x-client-id": "CF_TEST", "x-client-secret": "secret"}
+
+
+def fake_settings(secret, client_id="CF_TEST"):
+	"""Stand-in for the Cashfree Settings single with the given credentials"""
+	settings = MagicMock(environment="Sandbox", client_id=client_id)
+	settings.get_base_url.return_value = "https://payout-gamma.cashfree.com"
+	settings.get_password.return_value = secret
+	return settings
+
+
+class TestCashfreeSettingsCache(FrappeTestCase):
+	def setUp(self):
+		bav._settings_cache.pop(frappe.local.site, None)
+
+	def tearDown(self):
+		bav._settings_cache.pop(frappe.local.site, None)
+
+	def test_settings_are_memoized(self):
+		with patch("frappe.get_single", return_value=fake_settings("old-secret")) as get_single:
+			bav.get_client_secret()
+			bav.get_client_secret()
+
+		self.assertEqual(get_single.call_count, 1)
+
+	def test_version_bump_from_another_worker_reloads_settings(self):
+		with patch("frappe.get_single", return_value=fake_settings("old-secret")):
+			self.assertEqual(bav.get_client_secret(), "old-secret")
+
+		with patch("frappe.get_single", return_value=fake_settings("new-secret")):
+			# Not yet invalidated: the memoized copy is still served
+			self.assertEqual(bav.get_client_secret(), "old-secret")
+
+			# Another worker saved Cashfree Settings: only the shared version changes here
+			bav._bump_settings_version()
+			self.assertEqual(bav.get_client_secret(), "new-secret")
+
+
+class TestBAVInflightDedup(FrappeTestCase):
+	def _call_concurrently(self, calls):
+		"""Run post_bav_sync for each (site, headers, payload) while the first HTTP call is held open"""
+		started = threading.Event()
+		release = threading.Event()
+		post_calls = []
+
+		def fake_post(*args, **kwargs):
+			post_calls.append(kwargs["json"])
+			started.set()
+			release.wait(5)
+			resp = MagicMock(status_code=200, content=b'{"account_status": "VALID"}')
+			resp.text = '{"account_status": "VALID"}'
+			return resp
+
+		results = []
+		with patch.object(bav._session, "post", side_effect=fake_post):
+			threads = [
+				threading.Thread(
+					target=lambda s=site, h=headers, p=payload: results.append(bav.post_bav_sync(URL, p, h, s))
+				)
+				for site, headers, payload in calls
+			]
+			threads[0].start()
+			started.wait(5)
+			for thread in threads[1:]:
+				thread.start()
+			time.sleep(0.2)
+			release.set()
+			for thread in threads:
+				thread.join(5)
+
+		return post_calls, results
+
+	def test_concurrent_calls_share_one_request(self):
+		site = frappe.local.site
+		post_calls, results = self._call_concurrently([(site, HEADERS, PAYLOAD), (site, HEADERS, PAYLOAD)])
+
+		self.assertEqual(len(post_calls), 1)
+		self.assertEqual(len(results), 2)
+		self.assertEqual(results[0][:2], results[1][:2])
+		self.assertEqual(bav._inflight, {})
+
+	def test_other_site_or_client_does_not_share(self):
+		site = frappe.local.site
+		other_client = dict(HEADERS, **{"x-client-id": "CF_OTHER"})
+		post_calls, results = self._call_concurrently(
+			[(site, HEADERS, PAYLOAD), ("other.site", HEADERS, PAYLOAD), (site, other_client, PAYLOAD)]
+		)
+
+		self.assertEqual(len(post_calls), 3)
+		self.assertEqual(len(results), 3)
+
+	def test_different_party_name_does_not_share(self):
+		# name_match_score is computed against the name sent, so it can't be reused
+		site = frappe.local.site
+		post_calls, _ = self._call_concurrently(
+			[(site, HEADERS, PAYLOAD), (site, HEADERS, dict(PAYLOAD, name="Other Party"))]
+		)
+
+		self.assertEqual(len(post_calls), 2)
+		self.assertEqual({p["name"] for p in post_calls}, {"Test Party", "Other Party"})
+
+
+class TestBAVValidation(FrappeTestCase):
+	def test_validate_returns_normalized_values(self):
+		error, account_no, ifsc = bav.validate_bank_details(" 123456789012 ", " hdfc0001234 ")
+
+		self.assertIsNone(error)
+		self.assertEqual(account_no, "123456789012")
+		self.assertEqual(ifsc, "HDFC0001234")
+
+	def test_validate_rejects_bad_ifsc(self):
+		error, _, _ = bav.validate_bank_details("123456789012", "HDFC1234")
+		self.assertTrue(error)
+
+
+class TestBAVNameMatchScore(FrappeTestCase):
+	def _apply(self, score):
+		bank = frappe._dict(name="Test Bank Account", bank=None)
+		return bav.apply_bav_response(
+			bank, "HDFC0001234", "Test", 200, {"account_status": "VALID", "name_match_score": score}
+		)
+
+	def test_padded_score_is_parsed(self):
+		self.assertEqual(self._apply(" 85 ")["name_match_display"], "85.0%")
+
+	def test_blank_score_is_not_performed(self):
+		result = self._apply("   ")
+
+		self.assertEqual(result["name_match_display"], "Not Available")
+		self.assertIn("Not performed", result["name_match_warning"])
@@ -0,0 +1,70 @@
+# Copyright (c) 2026, Frappe and Contributors
+# See license.txt
+
+from unittest.mock import MagicMock, patch
+
+import frappe
+import requests
+from frappe.tests.utils import FrappeTestCase
+
+from cashfree_integration.api import bav, payouts
+
+
+def _wrapped_http_error(status_code):
+	"""Exception as raised by CashfreeAPIManager: a plain Exception raised while handling an HTTPError"""
+	try:
+		try:
+			raise requests.HTTPError(response=MagicMock(status_code=status_code))
+		except requests.HTTPError:
+			raise Exception("Transfer failed")
+	except Exception as e:
+		return e
+
+
+class TestCashfreeManagerCache(FrappeTestCase):
+	def setUp(self):
+		payouts._cf_manager_cache.pop(frappe.local.site, None)
+		self.manager = patch.object(payouts, "CashfreeAPIManager", side_effect=lambda: object())
+		self.manager.start()
+
+	def tearDown(self):
+		self.manager.stop()
+		payouts._cf_manager_cache.pop(frappe.local.site, None)
+
+	def test_manager_is_reused(self):
+		self.assertIs(payouts._get_cf_manager(), payouts._get_cf_manager())
+
+	def test_settings_version_bump_invalidates_other_workers(self):
+		mgr = payouts._get_cf_manager()
+
+		# Another worker saved Cashfree Settings: only the shared version changes here
+		bav._bump_settings_version()
+
+		self.assertIsNot(payouts._get_cf_manager(), mgr)
+
+	def test_expired_manager_is_rebuilt(self):
+		mgr = payouts._get_cf_manager(ttl=-1)
+		self.assertIsNot(payouts._get_cf_manager(), mgr)
+
+	def test_clearing_one_worker_does_not_bump_shared_version(self):
+		version = bav.get_settings_version()
+		mgr = payouts._get_cf_manager()
+
+		payouts.clear_cf_manager_cache()
+
+		self.assertEqual(bav.get_settings_version(), version)
+		self.assertIsNot(payouts._get_cf_manager(), mgr)
+
+	def test_only_auth_failures_count_as_credential_errors(self):
+		self.assertTrue(payouts._is_auth_failure(_wrapped_http_error(401)))
+		self.assertTrue(payouts._is_auth_failure(_wrapped_http_error(403)))
+		self.assertFalse(payouts._is_auth_failure(_wrapped_http_error(400)))
+		self.assertFalse(payouts._is_auth_failure(Exception("Beneficiary creation failed")))
+
+
+class TestPayoutLog(FrappeTestCase):
+	def test_payout_log_uses_naming_series(self):
+		payouts._write_payout_log("PR-TEST-0001", "PAYOUT-TEST-1", "NEFT", 100.0, "Success", "BENE_TEST", {})
+
+		name = frappe.db.get_value("Cashfree Payout Log", {"payout_id": "PAYOUT-TEST-1"}, "name")
+		self.assertTrue(name.startswith("CF-LOG-"))
@@ -0,0 +1,170 @@
+# Copyright (c) 2026, Frappe and Contributors
+# See license.txt
+
+import base64
+import hashlib
+import hmac
+import json
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from cashfree_integration.api import bav, webhook
+from cashfree_integration.api.test_bav import fake_settings
+
+SECRET = "test-webhook-secret"
+PROXY_IP = "127.0.0.1"
+CLIENT_IP = "203.0.113.7"
+SPOOFER_IP = "198.51.100.9"
+
+
+def _sign_v1(data, secret=SECRET):
+	payload = "".join(f"{k}={data[k]}" for k in sorted(data) if k not in webhook._V1_UNSIGNED_FIELDS)
+	digest = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+	return base64.b64encode(digest).decode()
+
+
+def _make_request(data, forwarded_for=CLIENT_IP):
+	builder = EnvironBuilder(
+		method="POST",
+		data=json.dumps(data),
+		content_type="application/json",
+		headers={"X-Forwarded-For": forwarded_for},
+		environ_base={"REMOTE_ADDR": PROXY_IP},
+	)
+	return Request(builder.get_environ())
+
+
+def _log_count(transfer_id):
+	return frappe.db.count("Cashfree Webhook Log", {"transfer_id": transfer_id})
+
+
+class TestWebhookSecretRotation(FrappeTestCase):
+	def setUp(self):
+		bav._settings_cache.pop(frappe.local.site, None)
+
+	def tearDown(self):
+		bav._settings_cache.pop(frappe.local.site, None)
+
+	def test_rotated_secret_is_used_once_settings_version_changes(self):
+		data = {"event": "TRANSFER_SUCCESS", "transferId": "CF-TEST-ROTATE"}
+		data["signature"] = _sign_v1(data, "new-secret")
+
+		with patch("frappe.get_single", return_value=fake_settings("old-secret")):
+			self.assertFalse(webhook.verify_cashfree_signature("", data, {}))
+
+		with patch("frappe.get_single", return_value=fake_settings("new-secret")):
+			# Secret rotated and saved on another worker
+			bav._bump_settings_version()
+			self.assertTrue(webhook.verify_cashfree_signature("", data, {}))
+
+
+class TestWebhookSignatureThrottle(FrappeTestCase):
+	def setUp(self):
+		self._request = getattr(frappe.local, "request", None)
+		frappe.cache().delete_value(f"cashfree:webhook_sig_fail:{CLIENT_IP}")
+		self.secret = patch.object(webhook, "get_client_secret", return_value=SECRET)
+		self.secret.start()
+
+	def tearDown(self):
+		self.secret.stop()
+		frappe.local.request = self._request
+		for ip in (CLIENT_IP, SPOOFER_IP):
+			frappe.cache().delete_value(f"cashfree:webhook_sig_fail:{ip}")
+
+	def _post(self, data, forwarded_for=CLIENT_IP):
+		frappe.local.request = _make_request(data, forwarded_for)
+		return webhook.cashfree_payout_webhook()
+
+	def _exhaust_failures(self):
+		for _ in range(webhook.SIGNATURE_FAILURE_LIMIT):
+			webhook._record_signature_failure(CLIENT_IP)
+
+	def test_client_address_ignores_spoofed_forwarded_for(self):
+		frappe.local.request = _make_request({}, forwarded_for=f"198.51.100.1, {CLIENT_IP}")
+		self.assertEqual(webhook._client_address(), CLIENT_IP)
+
+	def test_valid_signature_is_never_throttled(self):
+		self._exhaust_failures()
+
+		data = {"event": "TRANSFER_ACKNOWLEDGED", "transferId": "CF-TEST-VALID"}
+		data["signature"] = _sign_v1(data)
+
+		body, status = self._post(data)
+
+		self.assertEqual(status, 200)
+		self.assertEqual(body["status"], "ignored")
+
+	def test_bad_signature_is_recorded_then_throttled_without_log(self):
+		data = {"event": "TRANSFER_SUCCESS", "transferId": "CF-TEST-BADSIG", "signature": "bad"}
+
+		_, status = self._post(data)
+		self.assertEqual(status, 401)
+		self.assertEqual(_log_count("CF-TEST-BADSIG"), 1)
+		self.assertEqual(webhook._signature_failures(CLIENT_IP), 1)
+
+		self._exhaust_failures()
+		data["transferId"] = "CF-TEST-THROTTLED"
+
+		_, status = self._post(data)
+		self.assertEqual(status, 429)
+		self.assertEqual(_log_count("CF-TEST-THROTTLED"), 0)
+
+	def test_spoofed_forwarded_for_does_not_throttle_real_client(self):
+		# The proxy appends the real peer (SPOOFER_IP); a client-supplied CLIENT_IP to its left is ignored
+		data = {"event": "TRANSFER_SUCCESS", "transferId": "CF-TEST-SPOOF", "signature": "bad"}
+		for _ in range(webhook.SIGNATURE_FAILURE_LIMIT):
+			self._post(data, forwarded_for=f"{CLIENT_IP}, {SPOOFER_IP}")
+
+		self.assertEqual(webhook._signature_failures(CLIENT_IP), 0)
+
+
+class TestWebhookLog(FrappeTestCase):
+	def _create(self, transfer_id, status="Received"):
+		return webhook.create_webhook_log(
+			transfer_id=transfer_id,
+			webhook_event="TRANSFER_SUCCESS",
+			raw_payload="{}",
+			signature="",
+			timestamp=None,
+			headers="{}",
+			status=status,
+		)
+
+	def test_redelivery_upserts_one_row(self):
+		first = self._create("CF-TEST-UPSERT")
+		second = self._create("CF-TEST-UPSERT", status="Signature Verified")
+
+		self.assertEqual(first, second)
+		self.assertTrue(first.startswith("CWL-"))
+		self.assertEqual(_log_count("CF-TEST-UPSERT"), 1)
+
+		row = frappe.db.get_value("Cashfree Webhook Log", first, ["retry_count", "status"], as_dict=True)
+		self.assertEqual(row.retry_count, 2)
+		self.assertEqual(row.status, "Signature Verified")
+
+	def test_update_drops_unknown_fields(self):
+		name = self._create("CF-TEST-UNKNOWN")
+
+		webhook.update_webhook_log(name, {"status": "Error", "payment_entry_draft": "not-a-column"})
+
+		self.assertEqual(frappe.db.get_value("Cashfree Webhook Log", name, "status"), "Error")
+
+	def test_update_keeps_none_null(self):
+		name = self._create("CF-TEST-NULL")
+
+		webhook.update_webhook_log(name, {"error_log": None, "processing_time": 1.5})
+
+		row = frappe.db.get_value("Cashfree Webhook Log", name, ["error_log", "processing_time"], as_dict=True)
+		self.assertIsNone(row.error_log)
+		self.assertEqual(row.processing_time, 1.5)
+
+	def test_update_truncates_long_strings(self):
+		name = self._create("CF-TEST-TRUNCATE")
+
+		webhook.update_webhook_log(name, {"error_log": "x" * 5000})
+
+		self.assertEqual(len(frappe.db.get_value("Cashfree Webhook Log", name, "error_log")), 1000)
@@ -19,7 +19,39 @@ import hmac
 import hashlib
 import base64
 import time
-from frappe.utils import today, get_datetime_str
+from frappe.utils import today, now, get_datetime
+from frappe.model.naming import make_autoname
+from cashfree_integration.api.bav import get_client_secret
+
+try:
+    import orjson
+    
+    _json_loads = orjson.loads
+    
+    def _json_dumps(obj):
+        return orjson.dumps(obj, default=str).decode()
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps(obj):
+        return json.dumps(obj, default=str)
+
+
+# Oldest webhook (seconds, either direction) accepted before signature checks
+WEBHOOK_MAX_AGE = 300
+
+# Signature failures allowed per source IP per window before answering 429
+SIGNATURE_FAILURE_LIMIT = 20
+SIGNATURE_FAILURE_WINDOW = 60
+
+# Proxies whose X-Forwarded-For entries are trusted (cloudflared connects over loopback)
+TRUSTED_PROXIES = ("127.0.0.1", "::1")
+
+# Form fields left out of the V1 (form-encoded) signature payload
+_V1_UNSIGNED_FIELDS = frozenset(("signature", "cmd", "doctype"))
+
+# Keyed HMAC-SHA256 per site, rebuilt when the secret changes: {site: (secret, hmac)}
+_hmac_templates = {}
 
 
 # =====================================================
@@ -28,7 +60,6 @@ from frappe.utils import today, get_datetime_str
 
 @frappe.whitelist(allow_guest=True, methods=["POST"])
 def cashfree_payout_webhook():
-    start_time = time.time()
     webhook_log = None
     transfer_id = None
 
@@ -40,49 +71,59 @@ def cashfree_payout_webhook():
         headers = dict(frappe.request.headers)
 
         try:
-            data = json.loads(raw_body) if raw_body else {}
+            data = _json_loads(raw_body) if raw_body else {}
         except Exception:
             data = dict(frappe.local.form_dict)
 
         transfer_id = data.get("transferId") or data.get("transfer_id")
         event_type = (data.get("event") or "UNKNOWN").upper()
 
-        webhook_log = create_webhook_log(
+        log_fields = dict(
             transfer_id=transfer_id or f"UNKNOWN-{int(time.time())}",
             webhook_event=event_type,
             raw_payload=raw_body,
             signature=headers.get("x-webhook-signature") or data.get("signature"),
             timestamp=headers.get("x-webhook-timestamp"),
-            headers=json.dumps(headers, default=str),
-            status="Received"
+            headers=_json_dumps(headers)
         )
 
         # -------------------------------------------------
-        # 2. Signature verification (CORRECTED)
-        # -------------------------------------------------
-        if not verify_cashfree_signature(raw_body, data, headers):
-            update_webhook_log(webhook_log, {
-                "status": "Signature Failed", 
-                "error_log": "Invalid or missing signature/timestamp"
-            })
-            return {"status": "error", "message": "Invalid signature"}, 401
-
-        update_webhook_log(webhook_log, {"status": "Signature Verified"})
-
-        # -------------------------------------------------
-        # 3. Timestamp validation (NEW)
+        # 2. Timestamp validation - cheap, so stale/replayed
+        #    deliveries are rejected before any HMAC work
         # -------------------------------------------------
         timestamp = headers.get("x-webhook-timestamp")
         if timestamp:
-            webhook_time = get_datetime_str(timestamp)
-            time_diff = abs((frappe.utils.now_datetime() - webhook_time).total_seconds())
-            if time_diff > 300:  # 5 minutes tolerance
+            time_diff = _webhook_age_seconds(timestamp)
+            if time_diff is None or time_diff > WEBHOOK_MAX_AGE:
+                webhook_log = create_webhook_log(**log_fields, status="Received")
                 update_webhook_log(webhook_log, {
                     "status": "Timestamp Expired",
-                    "error_log": f"Webhook too old: {time_diff}s"
+                    "error_log": f"Webhook too old or invalid timestamp: {timestamp} ({time_diff}s)"
                 })
                 return {"status": "error", "message": "Timestamp expired"}, 400
 
+        # -------------------------------------------------
+        # 3. Signature verification (CORRECTED). A valid signature
+        #    is never throttled; repeated failures from one trusted
+        #    client address get 429 without writing a log row
+        # -------------------------------------------------
+        signature_ok = verify_cashfree_signature(raw_body, data, headers)
+
+        if not signature_ok:
+            client_ip = _client_address()
+            if _signature_failures(client_ip) >= SIGNATURE_FAILURE_LIMIT:
+                return {"status": "error", "message": "Too many requests"}, 429
+
+            _record_signature_failure(client_ip)
+            webhook_log = create_webhook_log(**log_fields, status="Received")
+            update_webhook_log(webhook_log, {
+                "status": "Signature Failed", 
+                "error_log": f"Invalid or missing signature/timestamp (from {client_ip})"
+            })
+            return {"status": "error", "message": "Invalid signature"}, 401
+
+        webhook_log = create_webhook_log(**log_fields, status="Signature Verified")
+
         # -------------------------------------------------
         # 4. Ignore non-success events
         # -------------------------------------------------
@@ -138,17 +179,23 @@ def cashfree_payout_webhook():
             return {"status": "error", "message": "Payment Request not found"}, 404
 
         # -------------------------------------------------
-        # 7. Create PE (Draft → Validate → Submit)
+        # 7. Create PE in the background (Draft → Validate → Submit)
+        #    job_id dedupes Cashfree redeliveries of the same transfer
         # -------------------------------------------------
-        result = create_payment_entry(payment_data, pr_name, webhook_log)
-
-        update_webhook_log(webhook_log, {
-            "processing_time": round(time.time() - start_time, 2),
-            "status": result.get("status"),
-            "payment_request": pr_name
-        })
+        update_webhook_log(webhook_log, {"payment_request": pr_name})
+
+        frappe.enqueue(
+            "cashfree_integration.api.webhook.process_transfer_success",
+            queue="short",
+            job_id=f"cashfree-pe-{payment_data['transfer_id']}",
+            deduplicate=True,
+            enqueue_after_commit=True,
+            payment_data=payment_data,
+            pr_name=pr_name,
+            webhook_log_name=webhook_log
+        )
 
-        return result, 200
+        return {"status": "queued", "payment_request": pr_name}, 200
 
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Cashfree Webhook Crash")
@@ -167,7 +214,7 @@ def cashfree_payout_webhook():
 # =====================================================
 
 def verify_cashfree_signature(raw_body, data, headers):
-    secret = frappe.db.get_single_value("Cashfree Settings", "client_secret")
+    secret = get_client_secret()
     if not secret:
         frappe.log_error("Cashfree client_secret missing", "Webhook Config")
         return False
@@ -175,9 +222,10 @@ def verify_cashfree_signature(raw_body, data, headers):
     # V1 – form encoded (sorted keys, exclude signature)
     sig_body = data.get("signature")
     if sig_body:
-        stripped = {k: v for k, v in data.items() if k not in ("signature", "cmd", "doctype")}
-        payload = "".join(f"{k}={stripped[k]}" for k in sorted(stripped))
-        computed = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+        payload = "".join(f"{k}={data[k]}" for k in sorted(data) if k not in _V1_UNSIGNED_FIELDS)
+        mac = _signature_hmac(secret)
+        mac.update(payload.encode())
+        computed = mac.digest()
         return hmac.compare_digest(
             base64.b64encode(computed).decode(),
             sig_body
@@ -189,11 +237,9 @@ def verify_cashfree_signature(raw_body, data, headers):
     
     if sig_header and timestamp:
         signed_payload = f"{timestamp}.{raw_body}"
-        computed = hmac.new(
-            secret.encode(),
-            signed_payload.encode(),
-            hashlib.sha256
-        ).digest()
+        mac = _signature_hmac(secret)
+        mac.update(signed_payload.encode())
+        computed = mac.digest()
         return hmac.compare_digest(
             base64.b64encode(computed).decode(),
             sig_header
@@ -202,21 +248,108 @@ def verify_cashfree_signature(raw_body, data, headers):
     return False
 
 
+def _webhook_age_seconds(timestamp):
+    """
+    Seconds between now and a webhook timestamp (epoch seconds/milliseconds or a datetime string)
+    Returns None when the timestamp can't be parsed.
+    """
+    try:
+        ts = float(timestamp)
+        if ts > 1e11:  # epoch milliseconds
+            ts /= 1000
+        return abs(time.time() - ts)
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        return abs((frappe.utils.now_datetime() - get_datetime(timestamp)).total_seconds())
+    except Exception:
+        return None
+
+
+def _client_address():
+    """
+    Client address as seen by the last trusted proxy
+    X-Forwarded-For is walked from the right, skipping hops in cashfree_trusted_proxies
+    (site config, default loopback for cloudflared), so a client-supplied left-most
+    entry can't pick the address that gets throttled.
+    """
+    trusted = set(frappe.conf.get("cashfree_trusted_proxies") or TRUSTED_PROXIES)
+    address = frappe.request.remote_addr or ""
+
+    if address in trusted:
+        forwarded = frappe.request.headers.get("X-Forwarded-For") or ""
+        for hop in reversed([h.strip() for h in forwarded.split(",") if h.strip()]):
+            address = hop
+            if hop not in trusted:
+                break
+
+    return address
+
+
+def _signature_failures(ip):
+    """Signature failures recorded for `ip` in the current window"""
+    cache = frappe.cache()
+    return int(cache.get(cache.make_key(f"cashfree:webhook_sig_fail:{ip}")) or 0)
+
+
+def _record_signature_failure(ip):
+    cache = frappe.cache()
+    key = cache.make_key(f"cashfree:webhook_sig_fail:{ip}")
+    if cache.incr(key) == 1:
+        cache.expire(key, SIGNATURE_FAILURE_WINDOW)
+
+
+def _signature_hmac(secret):
+    """Fresh copy of the keyed HMAC for `secret`, so the key is only set up once per site"""
+    cached = _hmac_templates.get(frappe.local.site)
+    if not cached or cached[0] != secret:
+        cached = (secret, hmac.new(secret.encode(), digestmod=hashlib.sha256))
+        _hmac_templates[frappe.local.site] = cached
+    
+    return cached[1].copy()
+
+
 # =====================================================
 # CORE BUSINESS LOGIC
 # =====================================================
 
-def create_payment_entry(payment_data, pr_name, webhook_log):
-    pr = frappe.get_doc("Payment Request", pr_name)
+def process_transfer_success(payment_data, pr_name, webhook_log_name):
+    """Background job: create the Payment Entry for a verified TRANSFER_SUCCESS webhook"""
+    start_time = time.time()
 
-    # Idempotency check (strict)
-    existing_pe = frappe.db.exists("Payment Entry", {
-        "reference_no": payment_data["utr"],
-        "party": pr.party,
-        "company": pr.company,
-        "docstatus": ["!=", 2]
-    })
+    try:
+        result = create_payment_entry(payment_data, pr_name, webhook_log_name)
+
+        update_webhook_log(webhook_log_name, {
+            "processing_time": round(time.time() - start_time, 2),
+            "status": result.get("status"),
+            "payment_request": pr_name
+        })
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "Cashfree Webhook Crash")
+        update_webhook_log(webhook_log_name, {
+            "status": "System Error",
+            "error_log": str(e) + "\n" + frappe.get_traceback()
+        })
+
+    frappe.db.commit()
+
+
+def create_payment_entry(payment_data, pr_name, webhook_log):
+    pr = frappe.db.get_value(
+        "Payment Request", pr_name, ["name", "party", "party_type", "company"], as_dict=True
+    )
+
+    # Idempotency check (strict, covered by pe_cashfree_reference_idx)
+    existing_pe = frappe.db.sql("""
+        SELECT name FROM `tabPayment Entry`
+        WHERE reference_no=%s AND party=%s AND company=%s AND docstatus!=2
+        LIMIT 1
+    """, (payment_data["utr"], pr.party, pr.company))
     if existing_pe:
+        existing_pe = existing_pe[0][0]
         update_webhook_log(webhook_log, {
             "status": "Duplicate", 
             "payment_entry": existing_pe
@@ -247,32 +380,27 @@ def create_payment_entry(payment_data, pr_name, webhook_log):
         "mode_of_payment": "Cashfree",
         "reference_no": payment_data["utr"],
         "reference_date": today(),
-        "remarks": (
-            f"Cashfree Payout\n"
-            f"PR: {pr.name}\n"
-            f"UTR: {payment_data['utr']}\n"
+        "remarks": "\n".join((
+            "Cashfree Payout",
+            f"PR: {pr.name}",
+            f"UTR: {payment_data['utr']}",
             f"Transfer ID: {payment_data['transfer_id']}"
-        )
+        ))
     })
 
     pe.insert(ignore_permissions=True)
-    frappe.db.commit()
 
     update_webhook_log(webhook_log, {"payment_entry_draft": pe.name})
 
+    # Savepoint keeps the draft (committed by the caller) if submit fails part-way
+    frappe.db.savepoint("cashfree_pe_submit")
     try:
         pe.submit()
-        frappe.db.commit()
         mark_pr_paid(pr.name)
         return {"status": "success", "payment_entry": pe.name}
     except Exception as e:
-        frappe.log_error(frappe.get_traceback(), f"PE Submit Failed {pe.name}")
-        # Auto-cancel draft on submit failure
-        try:
-            pe.cancel()
-            frappe.db.commit()
-        except:
-            pass
+        frappe.db.rollback(save_point="cashfree_pe_submit")
+        frappe.log_error(frappe.get_traceback(), f"PE Submit Failed {pe.name}", defer_insert=True)
         return {"status": "draft_failed", "payment_entry": pe.name, "error": str(e)}
 
 
@@ -281,48 +409,59 @@ def create_payment_entry(payment_data, pr_name, webhook_log):
 # =====================================================
 
 def find_payment_request(transfer_id):
-    """Find PR by name, cleaned name, or custom field"""
-    # Direct name match
-    pr = frappe.db.get_value("Payment Request", transfer_id)
-    if pr: return pr
-
-    # Handle underscore/dash conversion
+    """Find PR by name, cleaned name (underscore → dash), or custom field in one query"""
+    # Name matches win over the custom field (indexed by pr_cashfree_payout_id_idx)
     clean_id = transfer_id.replace("_", "-")
-    pr = frappe.db.get_value("Payment Request", clean_id)
-    if pr: return pr
+    pr = frappe.db.sql("""
+        SELECT name FROM `tabPayment Request`
+        WHERE name IN (%(id)s, %(clean_id)s) OR custom_cashfree_payout_id = %(id)s
+        ORDER BY name IN (%(id)s, %(clean_id)s) DESC
+        LIMIT 1
+    """, {"id": transfer_id, "clean_id": clean_id})
+    return pr[0][0] if pr else None
 
-    # Custom field match
-    pr = frappe.db.get_value("Payment Request", {"custom_cashfree_payout_id": transfer_id})
-    return pr
+
+def _request_cache():
+    """Per-request/job memo dict; frappe.local is reset between requests, so nothing goes stale"""
+    if not hasattr(frappe.local, "cashfree_cache"):
+        frappe.local.cashfree_cache = {}
+    return frappe.local.cashfree_cache
 
 
 def get_cashfree_account(company):
+    cache = _request_cache()
+    key = ("cashfree_account", company)
+    if key in cache:
+        return cache[key]
+
     # SIMPLER - exact match first
     account = frappe.db.get_value("Account", {
         "name": ["like", "Cashfree%"],
         "company": company
     }, "name")
-    return account or None  # Returns "Cashfree - KFPL"
+    cache[key] = account or None  # Returns "Cashfree - KFPL"
+    return cache[key]
 
 
 
 def get_party_account(party, company):
     """Get party account (Customer OR Supplier)"""
-    # Try Supplier first (payouts typically to suppliers)
-    acc = frappe.db.get_value("Party Account", {
-        "parent": party,
-        "parenttype": "Supplier", 
-        "company": company
-    }, "account")
-    if acc: return acc
-
-    # Fallback to Customer
-    acc = frappe.db.get_value("Party Account", {
-        "parent": party,
-        "parenttype": "Customer",
-        "company": company
-    }, "account")
-    if acc: return acc
+    cache = _request_cache()
+    key = ("party_account", party, company)
+    if key not in cache:
+        cache[key] = _get_party_account(party, company)
+    return cache[key]
+
+
+def _get_party_account(party, company):
+    # Supplier first (payouts typically to suppliers), then Customer - one query
+    acc = frappe.db.sql("""
+        SELECT account FROM `tabParty Account`
+        WHERE parent=%s AND company=%s AND parenttype IN ('Supplier', 'Customer')
+        ORDER BY FIELD(parenttype, 'Supplier', 'Customer')
+        LIMIT 1
+    """, (party, company))
+    if acc and acc[0][0]: return acc[0][0]
 
     # Final fallback
     return frappe.get_cached_value("Company", company, "default_payable_account")
@@ -330,13 +469,13 @@ def get_party_account(party, company):
 
 def mark_pr_paid(pr_name):
     """Mark Payment Request as paid"""
-    pr = frappe.get_doc("Payment Request", pr_name)
-    pr.db_set("status", "Paid")
-    pr.db_set("workflow_state", "Mark Paid")
-    pr.db_set("custom_reconciliation_status", "Success")
-    # Clear payout ID to prevent re-processing
-    pr.db_set("custom_cashfree_payout_id", "")
-    frappe.db.commit()
+    # Single UPDATE; clearing the payout ID prevents re-processing
+    frappe.db.set_value("Payment Request", pr_name, {
+        "status": "Paid",
+        "workflow_state": "Mark Paid",
+        "custom_reconciliation_status": "Success",
+        "custom_cashfree_payout_id": ""
+    })
 
 
 def update_failed_pr_status(transfer_id, event_type, data):
@@ -344,13 +483,15 @@ def update_failed_pr_status(transfer_id, event_type, data):
     status = "Failed" if "FAILED" in event_type else "Reversed"
     reason = (data.get("reason") or data.get("failure_reason") or "")[:500]
 
-    frappe.db.sql("""
-        UPDATE `tabPayment Request`
-        SET custom_reconciliation_status=%s,
-            custom_failure_reason=%s
-        WHERE name=%s OR custom_cashfree_payout_id=%s
-    """, (status, reason, transfer_id, transfer_id))
-    frappe.db.commit()
+    # Resolve the PR once so the write is a primary-key UPDATE
+    pr_name = find_payment_request(transfer_id)
+    if not pr_name:
+        return
+
+    frappe.db.set_value("Payment Request", pr_name, {
+        "custom_reconciliation_status": status,
+        "custom_failure_reason": reason
+    })
 
 
 # =====================================================
@@ -358,37 +499,48 @@ def update_failed_pr_status(transfer_id, event_type, data):
 # =====================================================
 
 def create_webhook_log(transfer_id, webhook_event, raw_payload, signature, timestamp, headers, status):
-    """Create or update webhook log (idempotent)"""
-    existing = frappe.db.exists("Cashfree Webhook Log", {"transfer_id": transfer_id})
-    if existing:
-        log = frappe.get_doc("Cashfree Webhook Log", existing)
-        log.retry_count += 1
-        log.db_set("status", status)
-        log.db_set("webhook_event", webhook_event)
-        return log
-
-    log = frappe.get_doc({
-        "doctype": "Cashfree Webhook Log",
-        "transfer_id": transfer_id,
-        "webhook_event": webhook_event,
-        "raw_payload": raw_payload[:32000],  # Truncate for DB limits
-        "signature": signature or "",
-        "webhook_timestamp": timestamp,
-        "headers": headers[:32000],
-        "status": status,
-        "retry_count": 1
-    })
-    log.insert(ignore_permissions=True)
-    frappe.db.commit()
-    return log
-
-
-def update_webhook_log(webhook_log, updates):  # line ~385
-    if isinstance(webhook_log, str):
-        webhook_log = frappe.get_doc("Cashfree Webhook Log", webhook_log)
-    
-    for field, value in updates.items():
-        webhook_log.set(field, str(value)[:1000] if isinstance(value, str) else value)
-    webhook_log.save(ignore_permissions=True)
-    return webhook_log.name
+    """Create or update webhook log (idempotent) in one upsert on the unique transfer_id; returns the log name"""
+    now_ts = now()
+    user = frappe.session.user
 
+    # A duplicate delivery burns one series number; the unique key keeps concurrent retries race-free
+    frappe.db.sql("""
+        INSERT INTO `tabCashfree Webhook Log`
+            (name, transfer_id, webhook_event, raw_payload, signature, headers, status,
+             retry_count, creation, modified, owner, modified_by)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, 1, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            retry_count = retry_count + 1,
+            status = VALUES(status),
+            webhook_event = VALUES(webhook_event),
+            modified = VALUES(modified)
+    """, (
+        make_autoname("CWL-.YYYY.-.#####", "Cashfree Webhook Log"),
+        transfer_id,
+        webhook_event,
+        raw_payload[:32000],  # Truncate for DB limits
+        signature or "",
+        headers[:32000],
+        status,
+        now_ts, now_ts, user, user
+    ))
+
+    return frappe.db.get_value("Cashfree Webhook Log", {"transfer_id": transfer_id}, "name")
+
+
+def update_webhook_log(webhook_log, updates):
+    """
+    Write log fields with one UPDATE; keys that are not columns of the log table are dropped
+    Strings are truncated to 1000 chars; None stays NULL and numbers are written as-is.
+    """
+    name = webhook_log if isinstance(webhook_log, str) else webhook_log.name
+    columns = frappe.db.get_table_columns("Cashfree Webhook Log")
+
+    values = {
+        field: value[:1000] if isinstance(value, str) else value
+        for field, value in updates.items()
+        if field in columns
+    }
+    if values:
+        frappe.db.set_value("Cashfree Webhook Log", name, values)
+    return name
@@ -5,6 +5,33 @@ import frappe
 import requests
 from frappe import _
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+    
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    
+    _json_loads = json.loads
+
+
+# Keep-alive session shared by every manager, so beneficiary check -> create -> transfer
+# reuse one TLS connection per worker. Retries cover connection failures and 502/503/504
+# on GET only (urllib3 won't replay a POST that was sent), so no transfer is sent twice.
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504))
+)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+# HTTP statuses Cashfree returns for a created beneficiary / transfer
+SUCCESS_STATUS_CODES = frozenset({200, 201})
 
 
 class CashfreeAPIManager:
@@ -21,6 +48,7 @@ class CashfreeAPIManager:
             frappe.throw(_("Cashfree Integration is not enabled."))
 
         self.environment = (self.settings.environment or "sandbox").lower()
+        self.payout_remarks_prefix = getattr(self.settings, "payout_remarks_prefix", None) or "TK"
 
         # Load API URLs
         self._load_urls()
@@ -132,10 +160,10 @@ class CashfreeAPIManager:
         try:
             frappe.logger().info(f"🔍 Verifying bank account: {account_number}")
 
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = _session.post(url, json=payload, headers=headers, timeout=30)
             response.raise_for_status()
 
-            result = response.json()
+            result = _json_loads(response.content)
             frappe.logger().info("✅ Bank verification success")
             return result
 
@@ -195,10 +223,10 @@ class CashfreeAPIManager:
             frappe.logger().info(f"🔄 Creating beneficiary: {bene_id}")
             frappe.logger().info(f"   URL: {url}")
 
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = _session.post(url, json=payload, headers=headers, timeout=30)
 
             try:
-                result = response.json()
+                result = _json_loads(response.content)
             except Exception:
                 result = {"message": response.text, "status_code": response.status_code}
 
@@ -209,7 +237,7 @@ class CashfreeAPIManager:
                     frappe.logger().info(f"✅ Beneficiary {bene_id} already exists")
                     return {"status": "SUCCESS", "message": "Beneficiary already exists", "beneficiary_id": bene_id}
 
-            if response.status_code in [200, 201]:
+            if response.status_code in SUCCESS_STATUS_CODES:
                 if result.get("beneficiary_id") or result.get("beneficiary_status") or result.get("data"):
                     frappe.logger().info(f"✅ Beneficiary created: {bene_id}")
                     return result
@@ -241,7 +269,7 @@ class CashfreeAPIManager:
         headers = self._get_headers_payout()
 
         try:
-            response = requests.get(
+            response = _session.get(
                 url,
                 headers=headers,
                 params={"beneficiary_id": bene_id},
@@ -249,7 +277,7 @@ class CashfreeAPIManager:
             )
 
             if response.status_code == 200:
-                result = response.json()
+                result = _json_loads(response.content)
                 return bool(result.get("beneficiary_id"))
 
             return False
@@ -267,14 +295,14 @@ class CashfreeAPIManager:
         headers = self._get_headers_payout()
 
         try:
-            response = requests.get(
+            response = _session.get(
                 url,
                 headers=headers,
                 params={"beneficiary_id": bene_id},
                 timeout=30,
             )
             response.raise_for_status()
-            return response.json()
+            return _json_loads(response.content)
 
         except requests.exceptions.HTTPError as e:
             if e.response is not None and e.response.status_code == 404:
@@ -294,7 +322,7 @@ class CashfreeAPIManager:
         url = f"{self.payout_base_url}/payout/transfers"
         headers = self._get_headers_payout()
 
-        remarks_prefix = self.settings.payout_remarks_prefix or "TK"
+        remarks_prefix = self.payout_remarks_prefix
         clean_remarks = remarks_prefix + " " + transfer_id.replace("-", " ")
         payload = {
     "transfer_id": transfer_id.replace("-", "_"),  # only alphanumeric + underscore allowed
@@ -312,16 +340,16 @@ class CashfreeAPIManager:
             frappe.logger().info(f"   URL: {url}")
             frappe.logger().info(f"   Beneficiary: {bene_id}")
 
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = _session.post(url, json=payload, headers=headers, timeout=30)
 
             try:
-                result = response.json()
+                result = _json_loads(response.content)
             except Exception:
                 result = {"message": response.text, "status_code": response.status_code}
 
             frappe.logger().info(f"   Response: {result}")
 
-            if response.status_code in [200, 201]:
+            if response.status_code in SUCCESS_STATUS_CODES:
                 frappe.logger().info("✅ Transfer created successfully")
                 return result
 
@@ -352,14 +380,14 @@ class CashfreeAPIManager:
         headers = self._get_headers_payout()
 
         try:
-            response = requests.get(
+            response = _session.get(
                 url,
                 headers=headers,
                 params={"transfer_id": transfer_id},
                 timeout=30,
             )
             response.raise_for_status()
-            return response.json()
+            return _json_loads(response.content)
 
         except Exception as e:
             frappe.log_error(f"Transfer Status Check Failed: {str(e)}", "Cashfree Payout Error")
@@ -370,7 +398,7 @@ class CashfreeAPIManager:
     def _extract_error_message(self, http_error):
         """Extract meaningful error message from HTTPError"""
         try:
-            error_data = http_error.response.json()
+            error_data = _json_loads(http_error.response.content)
             return error_data.get("message", str(http_error))
         except Exception:
             return http_error.response.text if http_error.response else str(http_error)
@@ -16,6 +16,11 @@ class CashfreeSettings(Document):
         if self.enabled and not (self.client_id and self.client_secret):
             frappe.throw("Client ID and Secret are required when Cashfree is enabled")
     
+    def on_update(self):
+        """Bump the shared settings version so every worker drops its memoized credentials"""
+        from cashfree_integration.api.bav import clear_settings_cache
+        clear_settings_cache()
+    
     def get_base_url(self, api_type):
         """Get base URL for specified API type"""
         if api_type == "payout":
@@ -23,9 +23,35 @@ has_permission = {
 # ========================================
 doc_events = {
     "Payment Request": {
-        "on_update_after_submit": "cashfree_integration.api.payouts.trigger_payout_for_payment_request",
+        "on_update_after_submit": [
+            "cashfree_integration.api.payouts.trigger_payout_for_payment_request",
+            "cashfree_integration.api.payment_validation.clear_po_payment_requests"
+        ],
         "after_workflow_action": "cashfree_integration.api.payouts.trigger_payout_for_payment_request",
-        "before_save": "cashfree_integration.api.payouts.trigger_payout_for_payment_request"
+        "before_save": "cashfree_integration.api.payouts.trigger_payout_for_payment_request",
+        "on_update": "cashfree_integration.api.payment_validation.clear_po_payment_requests",
+        "on_cancel": "cashfree_integration.api.payment_validation.clear_po_payment_requests",
+        "on_trash": "cashfree_integration.api.payment_validation.clear_po_payment_requests"
+    },
+    "Purchase Order": {
+        "on_update_after_submit": "cashfree_integration.api.payment_validation.clear_po_grand_total",
+        "on_cancel": "cashfree_integration.api.payment_validation.clear_po_grand_total",
+        "on_trash": "cashfree_integration.api.payment_validation.clear_po_grand_total"
+    },
+    "Bank Account": {
+        "on_update": "cashfree_integration.api.payment_validation.clear_bank_verification_status"
+    },
+    "Bank": {
+        "on_update": "cashfree_integration.api.bav.clear_bank_index",
+        "on_trash": "cashfree_integration.api.bav.clear_bank_index"
+    },
+    "Supplier": {
+        "on_update": "cashfree_integration.api.payouts.clear_party_display_name",
+        "on_trash": "cashfree_integration.api.payouts.clear_party_display_name"
+    },
+    "Customer": {
+        "on_update": "cashfree_integration.api.payouts.clear_party_display_name",
+        "on_trash": "cashfree_integration.api.payouts.clear_party_display_name"
     }
 }
 
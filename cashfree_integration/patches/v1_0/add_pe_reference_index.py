@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+    """Index Payment Entry by UTR/party/company (webhook idempotency check)"""
+    frappe.db.add_index(
+        "Payment Entry",
+        ["reference_no", "party", "company", "docstatus"],
+        index_name="pe_cashfree_reference_idx"
+    )
@@ -0,0 +1,13 @@
+import frappe
+
+
+def execute():
+    """Index Payment Request lookups by Cashfree payout id (webhook find_payment_request)"""
+    if not frappe.db.has_column("Payment Request", "custom_cashfree_payout_id"):
+        return
+
+    frappe.db.add_index(
+        "Payment Request",
+        ["custom_cashfree_payout_id"],
+        index_name="pr_cashfree_payout_id_idx"
+    )
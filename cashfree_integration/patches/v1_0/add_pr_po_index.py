@@ -0,0 +1,19 @@
+import frappe
+
+
+def execute():
+    """Index Payment Request lookups by Purchase Order (PO limit validation and payment status)"""
+    frappe.db.add_index(
+        "Payment Request",
+        ["reference_doctype", "reference_name", "docstatus"],
+        index_name="pr_ref_docstatus_idx"
+    )
+
+    if not frappe.db.has_column("Payment Request", "custom_reconciliation_status"):
+        return
+
+    frappe.db.add_index(
+        "Payment Request",
+        ["reference_name", "custom_reconciliation_status"],
+        index_name="pr_ref_recon_status_idx"
+    )
@@ -33,6 +33,76 @@ frappe.listview_settings['Payment Request'] = {
         
         console.log('✅ User has relevant roles. Showing appropriate buttons...');
         
+        // ====== BACKGROUND BULK JOBS (queue / retry) ======
+        // Server returns {job_id, total}; progress and completion arrive over realtime.
+        // The result is also fetched right after subscribing and polled as a fallback,
+        // since a fast job can finish before the listeners are registered.
+        // Polling stops once the job's 1800s timeout has passed without a result.
+        const BULK_JOB_TIMEOUT_MS = 1800 * 1000;
+        
+        function wait_for_bulk_job(job_id, progress_title, on_results) {
+            let finished = false;
+            let poll_timer = null;
+            let deadline = Date.now() + BULK_JOB_TIMEOUT_MS;
+            
+            let on_progress = function(data) {
+                if (data.job_id !== job_id) return;
+                frappe.show_progress(progress_title, data.done, data.total, __("Processing..."));
+            };
+            
+            let stop = function() {
+                if (finished) return false;
+                finished = true;
+                clearInterval(poll_timer);
+                frappe.realtime.off("bulk_payout_progress", on_progress);
+                frappe.realtime.off("bulk_payout_complete", on_complete);
+                frappe.hide_progress();
+                return true;
+            };
+            
+            let finish = function(results) {
+                if (stop()) on_results(results);
+            };
+            
+            let give_up = function() {
+                if (!stop()) return;
+                frappe.msgprint({
+                    title: __("Bulk Job Timed Out"),
+                    message: __("No result was received for job {0}. Check the Payment Requests before retrying.", [job_id]),
+                    indicator: "red"
+                });
+            };
+            
+            let fetch_result = function() {
+                if (finished) return;
+                frappe.call({
+                    method: "cashfree_integration.api.bulk_actions.get_bulk_result",
+                    args: { job_id: job_id },
+                    callback: function(r) {
+                        if (!r.exc && r.message) {
+                            finish(r.message);
+                        } else if (Date.now() > deadline) {
+                            give_up();
+                        }
+                    },
+                    error: function() {
+                        if (Date.now() > deadline) give_up();
+                    }
+                });
+            };
+            
+            let on_complete = function(data) {
+                if (data.job_id !== job_id) return;
+                fetch_result();
+            };
+            
+            frappe.realtime.on("bulk_payout_progress", on_progress);
+            frappe.realtime.on("bulk_payout_complete", on_complete);
+            
+            fetch_result();
+            poll_timer = setInterval(fetch_result, 5000);
+        }
+        
         // ====== BULK VERIFY REQUEST (Accounts Manager) ======
         if (user_roles.is_accountant) {
             console.log('Adding: Bulk Verify Request');
@@ -169,37 +239,43 @@ frappe.listview_settings['Payment Request'] = {
                             freeze_message: __("Queuing Payouts..."),
                             callback: function(r) {
                                 if (!r.exc) {
-                                    let results = r.message;
-                                    let success_count = results.success.length;
-                                    let failed_count = results.failed.length;
-                                    let skipped_count = results.skipped.length;
-                                    
-                                    let msg = `<b>Bulk Payout Results:</b><br><br>`;
-                                    msg += `✅ Success: ${success_count}<br>`;
-                                    msg += `❌ Failed: ${failed_count}<br>`;
-                                    msg += `⚠️ Skipped: ${skipped_count}<br><br>`;
-                                    
-                                    if (failed_count > 0) {
-                                        msg += `<b>Failed:</b><br>`;
-                                        results.failed.forEach(f => {
-                                            msg += `- ${f.name}: ${f.error}<br>`;
-                                        });
-                                    }
+                                    frappe.show_alert({
+                                        message: __("{0}: processing {1} Payment Request(s) in the background", ["Bulk Payout", r.message.total]),
+                                        indicator: "blue"
+                                    });
                                     
-                                    if (skipped_count > 0) {
-                                        msg += `<br><b>Skipped:</b><br>`;
-                                        results.skipped.forEach(s => {
-                                            msg += `- ${s.name}: ${s.reason}<br>`;
+                                    wait_for_bulk_job(r.message.job_id, __("Bulk Payout"), function(results) {
+                                        let success_count = results.success.length;
+                                        let failed_count = results.failed.length;
+                                        let skipped_count = results.skipped.length;
+                                        
+                                        let msg = `<b>Bulk Payout Results:</b><br><br>`;
+                                        msg += `✅ Success: ${success_count}<br>`;
+                                        msg += `❌ Failed: ${failed_count}<br>`;
+                                        msg += `⚠️ Skipped: ${skipped_count}<br><br>`;
+                                        
+                                        if (failed_count > 0) {
+                                            msg += `<b>Failed:</b><br>`;
+                                            results.failed.forEach(f => {
+                                                msg += `- ${f.name}: ${f.error}<br>`;
+                                            });
+                                        }
+                                        
+                                        if (skipped_count > 0) {
+                                            msg += `<br><b>Skipped:</b><br>`;
+                                            results.skipped.forEach(s => {
+                                                msg += `- ${s.name}: ${s.reason}<br>`;
+                                            });
+                                        }
+                                        
+                                        frappe.msgprint({
+                                            title: __("Bulk Payout Complete"),
+                                            message: msg,
+                                            indicator: success_count > 0 ? "green" : "orange"
                                         });
-                                    }
-                                    
-                                    frappe.msgprint({
-                                        title: __("Bulk Payout Complete"),
-                                        message: msg,
-                                        indicator: success_count > 0 ? "green" : "orange"
+                                        
+                                        listview.refresh();
                                     });
-                                    
-                                    listview.refresh();
                                 }
                             }
                         });
@@ -262,37 +338,43 @@ frappe.listview_settings['Payment Request'] = {
                             freeze_message: __("Retrying Failed Payouts..."),
                             callback: function(r) {
                                 if (!r.exc) {
-                                    let results = r.message;
-                                    let success_count = results.success.length;
-                                    let failed_count = results.failed.length;
-                                    let skipped_count = results.skipped.length;
-                                    
-                                    let msg = `<b>Bulk Retry Results:</b><br><br>`;
-                                    msg += `✅ Retried: ${success_count}<br>`;
-                                    msg += `❌ Failed: ${failed_count}<br>`;
-                                    msg += `⚠️ Skipped: ${skipped_count}<br><br>`;
-                                    
-                                    if (failed_count > 0) {
-                                        msg += `<b>Failed:</b><br>`;
-                                        results.failed.forEach(f => {
-                                            msg += `- ${f.name}: ${f.error}<br>`;
-                                        });
-                                    }
+                                    frappe.show_alert({
+                                        message: __("{0}: processing {1} Payment Request(s) in the background", ["Bulk Retry", r.message.total]),
+                                        indicator: "blue"
+                                    });
                                     
-                                    if (skipped_count > 0) {
-                                        msg += `<br><b>Skipped (not failed status):</b><br>`;
-                                        results.skipped.forEach(s => {
-                                            msg += `- ${s.name}: ${s.reason}<br>`;
+                                    wait_for_bulk_job(r.message.job_id, __("Bulk Retry"), function(results) {
+                                        let success_count = results.success.length;
+                                        let failed_count = results.failed.length;
+                                        let skipped_count = results.skipped.length;
+                                        
+                                        let msg = `<b>Bulk Retry Results:</b><br><br>`;
+                                        msg += `✅ Retried: ${success_count}<br>`;
+                                        msg += `❌ Failed: ${failed_count}<br>`;
+                                        msg += `⚠️ Skipped: ${skipped_count}<br><br>`;
+                                        
+                                        if (failed_count > 0) {
+                                            msg += `<b>Failed:</b><br>`;
+                                            results.failed.forEach(f => {
+                                                msg += `- ${f.name}: ${f.error}<br>`;
+                                            });
+                                        }
+                                        
+                                        if (skipped_count > 0) {
+                                            msg += `<br><b>Skipped (not failed status):</b><br>`;
+                                            results.skipped.forEach(s => {
+                                                msg += `- ${s.name}: ${s.reason}<br>`;
+                                            });
+                                        }
+                                        
+                                        frappe.msgprint({
+                                            title: __("Bulk Retry Complete"),
+                                            message: msg,
+                                            indicator: success_count > 0 ? "green" : "orange"
                                         });
-                                    }
-                                    
-                                    frappe.msgprint({
-                                        title: __("Bulk Retry Complete"),
-                                        message: msg,
-                                        indicator: success_count > 0 ? "green" : "orange"
+                                        
+                                        listview.refresh();
                                     });
-                                    
-                                    listview.refresh();
                                 }
                             }
                         });